@@ -0,0 +1,109 @@
+# backend/archive.py
+"""
+Archival of finished transcripts.
+
+Once a session has been ``completed`` and untouched for ``ARCHIVE_AFTER_DAYS``,
+its messages are compressed into a single ``message_archives`` row and
+deleted from ``messages``; transcript reads (``crud.get_messages``,
+``get_messages_page``, ``get_messages_since``) merge both, so callers never
+notice.  With partitioned messages (``backend.partitions``) each run also
+creates upcoming month partitions and drops old ones that archiving emptied.
+
+    python -m backend.archive --older-than-days 30
+
+or set ``ARCHIVE_INTERVAL`` (seconds) to run it inside every worker;
+concurrent runs skip each other's users.
+"""
+import os
+import asyncio
+import argparse
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import backend.crud as crud
+from backend import partitions
+from backend.metrics import ARCHIVED_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_INTERVAL   = float(os.getenv("ARCHIVE_INTERVAL", "0"))   # 0: only via the CLI
+ARCHIVE_BATCH      = int(os.getenv("ARCHIVE_BATCH", "200"))
+
+
+async def archive_completed(
+    session_factory,
+    older_than: timedelta = timedelta(days=ARCHIVE_AFTER_DAYS),
+    batch_size: int = ARCHIVE_BATCH,
+    max_batches: Optional[int] = None,
+) -> Dict[str, int]:
+    """Archive every eligible session, one transaction per batch of users; returns counts."""
+    cutoff = datetime.utcnow() - older_than
+    totals = {"sessions": 0, "messages": 0}
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        async with session_factory() as db:
+            user_ids = await crud.archivable_users(db, cutoff, limit=batch_size)
+            if not user_ids:
+                break
+            moved = 0
+            for user_id in user_ids:
+                moved += await crud.archive_messages(db, user_id)
+            await db.commit()
+        batches += 1
+        totals["sessions"] += len(user_ids)
+        totals["messages"] += moved
+        ARCHIVED_MESSAGES.inc(moved)
+        logger.info("archived %d messages of %d sessions", moved, len(user_ids))
+    return totals
+
+
+async def maintain_partitions(engine, older_than: timedelta = timedelta(days=ARCHIVE_AFTER_DAYS)) -> Dict[str, List[str]]:
+    """Create upcoming partitions and drop emptied ones older than the archive cutoff (Postgres only)."""
+    cutoff = datetime.utcnow() - older_than
+    async with engine.begin() as conn:
+        created = await conn.run_sync(partitions.ensure_partitions)
+        dropped = await conn.run_sync(partitions.drop_empty_partitions, cutoff)
+    return {"created": created, "dropped": dropped}
+
+
+async def run(engine, session_factory, older_than: timedelta = timedelta(days=ARCHIVE_AFTER_DAYS)) -> Dict:
+    report = await archive_completed(session_factory, older_than)
+    report.update(await maintain_partitions(engine, older_than))
+    return report
+
+
+async def run_periodically(engine, session_factory, every: float = ARCHIVE_INTERVAL) -> None:
+    while True:
+        await asyncio.sleep(every)
+        try:
+            await run(engine, session_factory)
+        except Exception:
+            logger.exception("archive run failed")
+
+
+# ------------------------------------------------------------------ #
+#  CLI
+# ------------------------------------------------------------------ #
+async def _main(args: argparse.Namespace) -> None:
+    from backend.db import engine, init_db, session_scope
+
+    try:
+        await init_db()
+        report = await run(engine, session_scope, timedelta(days=args.older_than_days))
+        print(report)
+    finally:
+        await engine.dispose()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Archive transcripts of completed sessions.")
+    parser.add_argument("--older-than-days", type=float, default=ARCHIVE_AFTER_DAYS,
+                        help="only sessions completed and idle for this long")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# backend/audio_upload.py
+import tempfile
+from typing import BinaryIO, Optional
+
+# formats Whisper accepts; anything else is treated as webm
+AUDIO_FORMATS = frozenset({"webm", "ogg", "mp3", "mp4", "m4a", "mpeg", "mpga", "wav"})
+
+
+class AudioUpload:
+    """
+    One in-flight voice message sent as ``user_audio_start`` → binary chunks →
+    ``user_audio_end``.
+
+    Chunks are written straight into a ``SpooledTemporaryFile``: small clips
+    stay in memory, anything past ``spool_bytes`` rolls over to disk.  Going
+    over ``max_bytes`` marks the upload as rejected; the rest is ignored.
+    """
+
+    def __init__(self, fmt: Optional[str], max_bytes: int, spool_bytes: int) -> None:
+        self.format    = fmt if fmt in AUDIO_FORMATS else "webm"
+        self.max_bytes = max_bytes
+        self.size      = 0
+        self.rejected  = False
+        self._file: Optional[BinaryIO] = tempfile.SpooledTemporaryFile(max_size=spool_bytes)
+
+    @property
+    def filename(self) -> str:
+        return f"audio.{self.format}"
+
+    def write(self, chunk: bytes) -> bool:
+        """Append *chunk*; returns False once the size cap has been exceeded."""
+        if self.rejected:
+            return False
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            self.rejected = True
+            self.close()
+            return False
+        self._file.write(chunk)
+        return True
+
+    def finish(self) -> Optional[BinaryIO]:
+        """File positioned at the start, or None if the upload was rejected/empty."""
+        if self.rejected or not self.size:
+            return None
+        self._file.seek(0)
+        return self._file
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,222 @@
+# backend/broadcast.py
+"""
+Live transcript fan-out for observers (agent dashboards).
+
+Committed turns become small JSON events, one per message and one per
+state change::
+
+    {"type": "message", "session": "...", "role": "user", "content": "...", "seq": 7, "at": "..."}
+    {"type": "state", "session": "...", "state": "collecting_email", "progress": 30}
+
+By default (``BROADCAST_MODE=local``) events are published in process once
+the turn commits, and only when this worker has observers.  With
+``BROADCAST_MODE=postgres`` each turn's transaction instead issues one
+``pg_notify`` and every worker keeps a single LISTEN connection that hands
+the payload to its local observers, so events reach dashboards on any
+worker.  That costs every commit the NOTIFY queue lock, whether or not
+anyone is watching, so it is opt-in.
+
+Each observer has a bounded buffer.  One that falls behind is dropped
+rather than slowing anyone else down, so observers cost memory only.
+"""
+import os
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import text
+
+from backend import codec
+from backend.flow import FLOW
+from backend.schemas import ConversationState
+from backend.metrics import OBSERVERS, BROADCAST_DROPPED
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "bindiq_events"
+NOTIFY_MAX_BYTES = 7900  # Postgres rejects NOTIFY payloads of 8000 bytes or more
+OBSERVER_BUFFER = int(os.getenv("OBSERVER_BUFFER", "256"))
+
+
+def _mode() -> str:
+    mode = os.getenv("BROADCAST_MODE", "local").lower()
+    if mode == "postgres":
+        from backend.db import DATABASE_URL
+        if not DATABASE_URL.startswith("postgresql"):
+            logger.warning("BROADCAST_MODE=postgres needs a Postgres DATABASE_URL; using local")
+            return "local"
+    return mode
+
+
+# ─── Events ────────────────────────────────────────────────────────── #
+def _encode(event: Dict) -> str:
+    payload = codec.dumps(event, default=str)
+    if len(payload.encode()) <= NOTIFY_MAX_BYTES or "content" not in event:
+        return payload
+    # long messages are cut to fit a notification; the transcript API has the full text
+    over = len(payload.encode()) - NOTIFY_MAX_BYTES
+    content = event["content"].encode()[: max(0, len(event["content"].encode()) - over - 64)]
+    return _encode({**event, "content": content.decode(errors="ignore"), "truncated": True})
+
+
+def turn_events(session_id: str, uow) -> List[str]:
+    """Encoded events for what a ``crud.UnitOfWork`` writes."""
+    events = [
+        _encode({"type": "message", "session": session_id, "role": m.role,
+                 "content": m.content, "seq": m.seq, "at": m.timestamp.isoformat()})
+        for m in uow.messages
+    ]
+    state = uow.session_fields.get("current_state")
+    if state is not None:
+        progress = FLOW.progress.get(ConversationState(state))
+        events.append(_encode({"type": "state", "session": session_id, "state": state, "progress": progress}))
+    return events
+
+
+# ─── Fan-out ───────────────────────────────────────────────────────── #
+class Subscription:
+    """One observer's buffer of encoded events; ``get`` returns None once it is closed or dropped."""
+
+    def __init__(self, session_id: Optional[str], buffer: int = OBSERVER_BUFFER) -> None:
+        self.session_id = session_id  # None: every session
+        self.queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue(buffer)
+        self.closed  = False
+        self.dropped = False
+
+    async def get(self) -> Optional[str]:
+        if self.closed and self.queue.empty():
+            return None
+        return await self.queue.get()
+
+    def close(self) -> None:
+        self.closed = True
+        try:
+            self.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass  # the reader still has items to drain, then sees ``closed``
+
+
+class Broadcaster:
+    """Per-worker registry of observers; ``dispatch`` hands one encoded event to each interested one."""
+
+    def __init__(self, buffer: int = OBSERVER_BUFFER, mode: str = "local") -> None:
+        self.buffer = buffer
+        self.mode   = mode  # "postgres" | "local" | "off"
+        self._subs: Dict[Optional[str], Set[Subscription]] = {}
+
+    @property
+    def has_observers(self) -> bool:
+        return bool(self._subs)
+
+    def subscribe(self, session_id: Optional[str] = None) -> Subscription:
+        sub = Subscription(session_id, self.buffer)
+        self._subs.setdefault(session_id, set()).add(sub)
+        OBSERVERS.inc()
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        subs = self._subs.get(sub.session_id)
+        if subs is not None and sub in subs:
+            subs.discard(sub)
+            if not subs:
+                del self._subs[sub.session_id]
+            OBSERVERS.dec()
+        sub.close()
+
+    def dispatch(self, payload: str, session_id: Optional[str] = None) -> None:
+        if not self._subs:
+            return
+        if session_id is None:
+            session_id = codec.loads(payload).get("session")
+        for sub in (*self._subs.get(session_id, ()), *self._subs.get(None, ())):
+            try:
+                sub.queue.put_nowait(payload)
+            except asyncio.QueueFull:
+                # a slow observer loses its subscription, not everyone else's latency
+                sub.dropped = True
+                BROADCAST_DROPPED.inc()
+                self.unsubscribe(sub)
+
+    def sink(self, session_id: str) -> Optional["EventSink"]:
+        """What a connection attaches to its units of work (None when broadcasting is off)."""
+        if self.mode == "off":
+            return None
+        return EventSink(self, session_id, postgres=self.mode == "postgres")
+
+
+class EventSink:
+    """
+    Attached to a ``crud.UnitOfWork``: ``stage`` runs inside its transaction
+    (NOTIFY is only delivered on commit), ``committed`` after it.
+    """
+
+    def __init__(self, broadcaster: Broadcaster, session_id: str, postgres: bool) -> None:
+        self.broadcaster = broadcaster
+        self.session_id  = session_id
+        self.postgres    = postgres
+
+    async def stage(self, db, uow) -> None:
+        if not self.postgres:
+            return
+        payloads = turn_events(self.session_id, uow)
+        if payloads:
+            await db.execute(
+                text("SELECT pg_notify(:channel, p) FROM unnest(CAST(:payloads AS text[])) AS p"),
+                {"channel": CHANNEL, "payloads": payloads},
+            )
+
+    def committed(self, uow) -> None:
+        if self.postgres or not self.broadcaster.has_observers:
+            return
+        for payload in turn_events(self.session_id, uow):
+            self.broadcaster.dispatch(payload, self.session_id)
+
+
+# ─── Postgres LISTEN ───────────────────────────────────────────────── #
+class PgListener:
+    """One LISTEN connection per worker, reconnecting with backoff when it drops."""
+
+    def __init__(self, broadcaster: Broadcaster, dsn: str) -> None:
+        self.broadcaster = broadcaster
+        self.dsn   = dsn.replace("postgresql+asyncpg://", "postgresql://", 1)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def _on_notify(self, conn, pid, channel, payload) -> None:
+        self.broadcaster.dispatch(payload)
+
+    async def _run(self) -> None:
+        import asyncpg
+
+        delay = 1.0
+        while True:
+            lost = asyncio.Event()
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.dsn)
+                conn.add_termination_listener(lambda _: lost.set())
+                await conn.add_listener(CHANNEL, self._on_notify)
+                logger.info("listening for %s", CHANNEL)
+                delay = 1.0
+                await lost.wait()
+                logger.warning("LISTEN connection lost; reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.warning("LISTEN connection failed: %s", exc)
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+
+def build_broadcaster() -> Broadcaster:
+    return Broadcaster(mode=_mode())
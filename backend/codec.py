@@ -0,0 +1,34 @@
+# backend/codec.py
+"""
+JSON encoding for WebSocket frames and JSON columns.
+
+Uses the optional ``orjson`` package when it is installed (several times
+faster, and it returns bytes we only have to decode once); otherwise the
+stdlib with the same compact separators Starlette's ``send_json`` uses.
+``JSON_CODEC=json`` forces the stdlib.
+"""
+import os
+import json
+from typing import Any, Callable, Optional
+
+try:
+    import orjson
+except ImportError:  # optional
+    orjson = None
+
+if os.getenv("JSON_CODEC", "auto") == "json":
+    orjson = None
+
+NAME = "orjson" if orjson is not None else "json"
+
+
+def dumps(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, default=default).decode()
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=default)
+
+
+def loads(data: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -1,12 +1,23 @@
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
-from typing import Optional, List
-import json
+from sqlalchemy import JSON, Row, Text, case, cast, delete, func, literal, tuple_, update
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from typing import Any, Callable, Optional, List, Tuple
+from collections import namedtuple
+from datetime import datetime
+import asyncio
+import logging
+import zlib
 
-from .models import User, ChatMessage, Vehicle, Session as SessionModel
+from . import codec
+from .models import User, ChatMessage, Vehicle, Session as SessionModel, SessionLease, MessageArchive
 from .schemas import ConversationState
+from .metrics import DB_SECONDS, timed
 
+logger = logging.getLogger(__name__)
 
+
+@timed(DB_SECONDS, op="get_or_create_user")
 async def get_or_create_user(db: AsyncSession, session_id: str) -> User:
     result = await db.execute(
         select(User).where(User.session_id == session_id)
@@ -15,14 +26,13 @@ async def get_or_create_user(db: AsyncSession, session_id: str) -> User:
     if not user:
         user = User(session_id=session_id)
         db.add(user)
-        await db.commit()
-        await db.refresh(user)
+        await db.flush()  # assigns user.id
 
-        # create initial session
+        # create initial session in the same transaction
         session = SessionModel(
             user_id=user.id,
             current_state=ConversationState.start.value,
-            state_data="{}",
+            state_data={},
         )
         db.add(session)
         await db.commit()
@@ -30,64 +40,528 @@ async def get_or_create_user(db: AsyncSession, session_id: str) -> User:
     return user
 
 
+@timed(DB_SECONDS, op="load_session")
+async def load_session(db: AsyncSession, session_id: str) -> Optional[Row]:
+    """
+    Everything a (re)connect needs, in one round trip: the user, their
+    session, the last message if the assistant sent it (the question still
+    open) and the highest message ``seq`` (hot and archived).  None if the
+    session id is unknown.
+    """
+    # a turn cut short commits the answer and the new state without a reply,
+    # so an assistant message followed by the user's is no longer the open question
+    last_reply = (
+        select(case((ChatMessage.role == "assistant", ChatMessage.content)))
+        .where(ChatMessage.user_id == User.id)
+        .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+        .limit(1)
+        .correlate(User)
+        .scalar_subquery()
+    )
+    last_seq = (
+        select(func.max(ChatMessage.seq)).where(ChatMessage.user_id == User.id).correlate(User).scalar_subquery()
+    )
+    archived_seq = (
+        select(MessageArchive.last_seq).where(MessageArchive.user_id == User.id).correlate(User).scalar_subquery()
+    )
+    result = await db.execute(
+        select(
+            User, SessionModel, last_reply.label("last_reply"),
+            last_seq.label("last_seq"), archived_seq.label("archived_seq"),
+        )
+        .outerjoin(SessionModel, SessionModel.user_id == User.id)
+        .where(User.session_id == session_id)
+        .execution_options(populate_existing=True)
+    )
+    return result.one_or_none()
+
+
+@timed(DB_SECONDS, op="save_message")
 async def save_message(
-    db: AsyncSession, user_id: int, role: str, content: str
+    db: AsyncSession, user_id: int, role: str, content: str, refresh: bool = True,
+    seq: Optional[int] = None, client_id: Optional[str] = None,
 ) -> ChatMessage:
-    message = ChatMessage(user_id=user_id, role=role, content=content)
+    message = ChatMessage(user_id=user_id, role=role, content=content, seq=seq, client_id=client_id)
     db.add(message)
     await db.commit()
-    await db.refresh(message)
+    if refresh:
+        await db.refresh(message)
     return message
 
 
+@timed(DB_SECONDS, op="get_messages")
 async def get_messages(db: AsyncSession, user_id: int) -> List[ChatMessage]:
+    """The whole transcript, archived part included."""
     result = await db.execute(
         select(ChatMessage)
         .where(ChatMessage.user_id == user_id)
         .order_by(ChatMessage.timestamp)
     )
-    return result.scalars().all()
+    messages = result.scalars().all()
+    archived = await _archived(db, user_id)
+    if not archived:
+        return messages
+    old = [ChatMessage(user_id=user_id, **m._asdict()) for m in archived]
+    return sorted([*old, *messages], key=lambda m: (m.timestamp, m.id))
 
 
+@timed(DB_SECONDS, op="get_messages_page")
+async def get_messages_page(
+    db: AsyncSession,
+    session_id: str,
+    limit: int = 50,
+    before: Optional[Tuple[datetime, int]] = None,
+    after: Optional[Tuple[datetime, int]] = None,
+) -> Optional[List[Row]]:
+    """
+    Keyset page of (id, role, content, timestamp, seq) rows for a chat session.
+
+    With *after* the page walks forward from that position; otherwise it
+    walks backwards from *before* (or the newest message).  Returns up to
+    ``limit + 1`` rows so callers can tell whether more exist, or None if the
+    session is unknown.  Archived messages are merged in by the same key.
+    """
+    found = (await db.execute(
+        select(User.id, MessageArchive.data)
+        .outerjoin(MessageArchive, MessageArchive.user_id == User.id)
+        .where(User.session_id == session_id)
+    )).one_or_none()
+    if found is None:
+        return None
+    user_id, archive = found
+
+    key = tuple_(ChatMessage.timestamp, ChatMessage.id)
+    query = (
+        select(ChatMessage.id, ChatMessage.role, ChatMessage.content, ChatMessage.timestamp, ChatMessage.seq)
+        .where(ChatMessage.user_id == user_id)
+    )
+    if after is not None:
+        query = query.where(key > tuple_(*after)).order_by(ChatMessage.timestamp, ChatMessage.id)
+    else:
+        if before is not None:
+            query = query.where(key < tuple_(*before))
+        query = query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+    result = await db.execute(query.limit(limit + 1))
+    rows = result.all()
+    if archive is None:
+        return rows
+
+    archived = [
+        m for m in unpack_messages(archive)
+        if (after is None or (m.timestamp, m.id) > after) and (before is None or (m.timestamp, m.id) < before)
+    ]
+    rows = sorted([*rows, *archived], key=lambda r: (r.timestamp, r.id), reverse=after is None)
+    return rows[: limit + 1]
+
+
+@timed(DB_SECONDS, op="get_messages_since")
+async def get_messages_since(db: AsyncSession, user_id: int, after_seq: int, limit: int = 500) -> List[Row]:
+    """(seq, role, content, client_id) rows with ``seq > after_seq``, oldest first, archived ones included."""
+    result = await db.execute(
+        select(ChatMessage.seq, ChatMessage.role, ChatMessage.content, ChatMessage.client_id)
+        .where(ChatMessage.user_id == user_id, ChatMessage.seq > after_seq)
+        .order_by(ChatMessage.seq)
+        .limit(limit)
+    )
+    rows = result.all()
+    archive = (await db.execute(
+        select(MessageArchive.data).where(MessageArchive.user_id == user_id, MessageArchive.last_seq > after_seq)
+    )).scalar_one_or_none()
+    if archive is None:
+        return rows
+    archived = [m for m in unpack_messages(archive) if m.seq is not None and m.seq > after_seq]
+    return sorted([*archived, *rows], key=lambda r: r.seq)[:limit]
+
+
+@timed(DB_SECONDS, op="get_client_ids")
+async def get_client_ids(db: AsyncSession, user_id: int, limit: int = 256) -> List[Row]:
+    """(client_id, seq) of the user's latest *limit* messages that carry a client id, newest first."""
+    result = await db.execute(
+        select(ChatMessage.client_id, ChatMessage.seq)
+        .where(ChatMessage.user_id == user_id, ChatMessage.client_id.is_not(None))
+        .order_by(ChatMessage.seq.desc())
+        .limit(limit)
+    )
+    return result.all()
+
+
+@timed(DB_SECONDS, op="get_session")
 async def get_session(db: AsyncSession, user_id: int) -> Optional[SessionModel]:
+    # populate_existing: writes may have landed through another session (UnitOfWork / group commit)
     result = await db.execute(
-        select(SessionModel).where(SessionModel.user_id == user_id)
+        select(SessionModel)
+        .where(SessionModel.user_id == user_id)
+        .execution_options(populate_existing=True)
     )
     return result.scalar_one_or_none()
 
 
+@timed(DB_SECONDS, op="update_session_state")
 async def update_session_state(
     db: AsyncSession,
     user_id: int,
     state: str,
     state_data: Optional[dict] = None,
+    refresh: bool = True,
 ) -> SessionModel:
     session = await get_session(db, user_id)
     if session:
         session.current_state = state
         if state_data is not None:
-            session.state_data = json.dumps(state_data)
+            session.state_data = state_data
+        session.updated_at = datetime.utcnow()
         await db.commit()
-        await db.refresh(session)
+        if refresh:
+            await db.refresh(session)
     return session
 
 
+@timed(DB_SECONDS, op="save_vehicle")
 async def save_vehicle(
-    db: AsyncSession, user_id: int, vehicle_data: dict
+    db: AsyncSession, user_id: int, vehicle_data: dict, refresh: bool = True
 ) -> Vehicle:
     vehicle = Vehicle(user_id=user_id, **vehicle_data)
     db.add(vehicle)
     await db.commit()
-    await db.refresh(vehicle)
+    if refresh:
+        await db.refresh(vehicle)
     return vehicle
 
 
-async def update_user(db: AsyncSession, user_id: int, **kwargs) -> User:
+@timed(DB_SECONDS, op="update_user")
+async def update_user(db: AsyncSession, user_id: int, refresh: bool = True, **kwargs) -> User:
     result = await db.execute(select(User).where(User.id == user_id))
     user = result.scalar_one()
     for key, value in kwargs.items():
         if hasattr(user, key):
             setattr(user, key, value)
+    user.updated_at = datetime.utcnow()
     await db.commit()
-    await db.refresh(user)
+    if refresh:
+        await db.refresh(user)
     return user
+
+
+# ------------------------------------------------------------------ #
+#  Archived transcripts
+# ------------------------------------------------------------------ #
+ArchivedMessage = namedtuple("ArchivedMessage", "id role content timestamp seq client_id")
+
+
+def pack_messages(messages: List[ArchivedMessage]) -> bytes:
+    rows = [[m.id, m.role, m.content, m.timestamp.isoformat(), m.seq, m.client_id] for m in messages]
+    return zlib.compress(codec.dumps(rows).encode())
+
+
+def unpack_messages(data: Optional[bytes]) -> List[ArchivedMessage]:
+    if not data:
+        return []
+    return [
+        ArchivedMessage(msg_id, role, content, datetime.fromisoformat(ts), seq, client_id)
+        for msg_id, role, content, ts, seq, client_id in codec.loads(zlib.decompress(data))
+    ]
+
+
+async def _archived(db: AsyncSession, user_id: int) -> List[ArchivedMessage]:
+    data = (await db.execute(
+        select(MessageArchive.data).where(MessageArchive.user_id == user_id)
+    )).scalar_one_or_none()
+    return unpack_messages(data)
+
+
+@timed(DB_SECONDS, op="archivable_users")
+async def archivable_users(db: AsyncSession, before: datetime, limit: int = 200) -> List[int]:
+    """
+    Users whose session completed and was last touched before *before* and
+    who still have messages in the hot table.  Rows are locked (SKIP LOCKED
+    on Postgres) so concurrent archivers take different users.
+    """
+    has_messages = select(ChatMessage.id).where(ChatMessage.user_id == SessionModel.user_id).exists()
+    result = await db.execute(
+        select(SessionModel.user_id)
+        .where(
+            SessionModel.current_state == ConversationState.completed.value,
+            SessionModel.updated_at < before,
+            has_messages,
+        )
+        .order_by(SessionModel.updated_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    return list(result.scalars().all())
+
+
+@timed(DB_SECONDS, op="archive_messages")
+async def archive_messages(db: AsyncSession, user_id: int) -> int:
+    """
+    Move *user_id*'s hot messages into their ``MessageArchive`` row (merged
+    with what an earlier run archived) and return how many moved.  The
+    caller commits.
+    """
+    hot = (await db.execute(
+        select(ChatMessage.id, ChatMessage.role, ChatMessage.content, ChatMessage.timestamp,
+               ChatMessage.seq, ChatMessage.client_id)
+        .where(ChatMessage.user_id == user_id)
+        .order_by(ChatMessage.timestamp, ChatMessage.id)
+    )).all()
+    if not hot:
+        return 0
+    archive = (await db.execute(
+        select(MessageArchive).where(MessageArchive.user_id == user_id)
+    )).scalar_one_or_none()
+
+    messages = unpack_messages(archive.data if archive else None) + [ArchivedMessage(*row) for row in hot]
+    fields = {
+        "message_count": len(messages),
+        "first_at": messages[0].timestamp,
+        "last_at": messages[-1].timestamp,
+        "last_seq": max((m.seq for m in messages if m.seq is not None), default=None),
+        "data": pack_messages(messages),
+        "archived_at": datetime.utcnow(),
+    }
+    if archive is None:
+        db.add(MessageArchive(user_id=user_id, **fields))
+    else:
+        for key, value in fields.items():
+            setattr(archive, key, value)
+    await db.execute(
+        delete(ChatMessage).where(ChatMessage.user_id == user_id, ChatMessage.id.in_([row.id for row in hot]))
+    )
+    return len(hot)
+
+
+# ------------------------------------------------------------------ #
+#  Session leases
+# ------------------------------------------------------------------ #
+class LeaseLost(Exception):
+    """A newer connection owns the session; this one's writes are refused."""
+
+
+def _patched_state_data(dialect: str, patches: List[tuple]):
+    """
+    ``sessions.state_data`` with *patches* (``("set", path, value)`` or
+    ``("del", path, None)``) applied in place: ``jsonb_set`` / ``#-`` on
+    Postgres, the JSON1 ``json_set`` / ``json_remove`` on SQLite.
+    """
+    expr = SessionModel.__table__.c.state_data
+    for op, path, value in patches:
+        if dialect == "postgresql":
+            keys = cast(literal(list(path), ARRAY(Text)), ARRAY(Text))
+            if op == "set":
+                expr = func.jsonb_set(expr, keys, literal(value, JSONB), True, type_=JSONB)
+            else:
+                expr = expr.op("#-", return_type=JSONB)(keys)
+        else:
+            where = "$" + "".join(f'."{key}"' for key in path)
+            if op == "set":
+                expr = func.json_set(expr, where, func.json(literal(value, JSON)), type_=JSON)
+            else:
+                expr = func.json_remove(expr, where, type_=JSON)
+    return expr
+
+
+def _upsert(db: AsyncSession):
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+@timed(DB_SECONDS, op="acquire_lease")
+async def acquire_lease(db: AsyncSession, session_id: str, owner: str) -> int:
+    """Take the session over (whoever held it) and return the new fencing token."""
+    now = datetime.utcnow()
+    stmt = _upsert(db)(SessionLease).values(session_id=session_id, owner=owner, token=1, updated_at=now)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SessionLease.session_id],
+        set_={
+            "owner": stmt.excluded.owner,
+            "token": SessionLease.token + 1,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    ).returning(SessionLease.token)
+    token = (await db.execute(stmt)).scalar_one()
+    await db.commit()
+    return token
+
+
+async def fence_lease(db: AsyncSession, session_id: str, token: int) -> None:
+    """
+    Raise ``LeaseLost`` unless *token* still holds the session.
+
+    Run inside a write transaction this is the fencing check: the row lock
+    it takes makes a concurrent takeover wait for the commit.
+    """
+    current = (await db.execute(
+        select(SessionLease.token).where(SessionLease.session_id == session_id).with_for_update()
+    )).scalar_one_or_none()
+    if current != token:
+        raise LeaseLost(session_id)
+
+
+# ------------------------------------------------------------------ #
+#  Unit of work / write-behind
+# ------------------------------------------------------------------ #
+class UnitOfWork:
+    """
+    Collects one turn's writes for a user and flushes them in one transaction.
+
+    Mirrors the single-shot helpers above (``save_message``, ``update_user``,
+    ``update_session_state``, ``save_vehicle``) but nothing touches the DB
+    until ``flush``; updates are issued as plain UPDATEs without a prior
+    SELECT and nothing is refreshed unless asked for.
+
+    With a *lease* (anything with ``session_id`` and ``token``) the
+    transaction is fenced: it fails with ``LeaseLost`` once a newer
+    connection has taken the session over.  *events* (see
+    ``backend.broadcast.EventSink``) is told about the writes inside the
+    transaction (``stage``) and once they are committed (``committed``).
+    """
+
+    def __init__(self, user_id: int, lease: Any = None, events: Any = None) -> None:
+        self.user_id = user_id
+        self.lease   = lease
+        self.events  = events
+        self.messages: List[ChatMessage] = []
+        self.vehicles: List[Vehicle] = []
+        self.user_fields: dict = {}
+        self.session_fields: dict = {}
+        self.state_patches: List[tuple] = []
+
+    def __bool__(self) -> bool:
+        return bool(self.messages or self.vehicles or self.user_fields or self.session_fields or self.state_patches)
+
+    # ------------------------------------------------------------------ #
+    def save_message(
+        self, role: str, content: str, seq: Optional[int] = None, client_id: Optional[str] = None
+    ) -> ChatMessage:
+        message = ChatMessage(user_id=self.user_id, role=role, content=content, seq=seq, client_id=client_id)
+        self.messages.append(message)
+        return message
+
+    def save_vehicle(self, vehicle_data: dict) -> Vehicle:
+        vehicle = Vehicle(user_id=self.user_id, **vehicle_data)
+        self.vehicles.append(vehicle)
+        return vehicle
+
+    def update_user(self, **kwargs) -> None:
+        self.user_fields.update({k: v for k, v in kwargs.items() if hasattr(User, k)})
+
+    def update_session_state(self, state: str, state_data: Optional[dict] = None) -> None:
+        self.session_fields["current_state"] = state
+        if state_data is not None:
+            self.session_fields["state_data"] = state_data
+            self.state_patches = []
+
+    def patch_state_data(self, patches: List[tuple]) -> None:
+        """Change parts of ``state_data`` in place (see ``_patched_state_data``) instead of rewriting it."""
+        self.state_patches.extend(patches)
+
+    # ------------------------------------------------------------------ #
+    async def apply(self, db: AsyncSession) -> None:
+        """Stage every write on *db* without committing."""
+        if self.lease is not None:
+            await fence_lease(db, self.lease.session_id, self.lease.token)
+        now = datetime.utcnow()
+        if self.user_fields:
+            await db.execute(
+                update(User).where(User.id == self.user_id).values(**self.user_fields, updated_at=now)
+            )
+        if self.session_fields or self.state_patches:
+            fields = dict(self.session_fields)
+            if self.state_patches and "state_data" not in fields:
+                fields["state_data"] = _patched_state_data(db.bind.dialect.name, self.state_patches)
+            await db.execute(
+                update(SessionModel)
+                .where(SessionModel.user_id == self.user_id)
+                .values(**fields, updated_at=now)
+            )
+        db.add_all(self.messages)
+        db.add_all(self.vehicles)
+        if self.events is not None:
+            await self.events.stage(db, self)
+
+    def committed(self) -> None:
+        if self.events is not None:
+            try:
+                self.events.committed(self)
+            except Exception:
+                logger.exception("publishing committed writes failed")
+
+    @timed(DB_SECONDS, op="uow_flush")
+    async def flush(self, db: AsyncSession, refresh: bool = False) -> None:
+        if not self:
+            return
+        await self.apply(db)
+        await db.commit()
+        self.committed()
+        if refresh:
+            for obj in (*self.messages, *self.vehicles):
+                await db.refresh(obj)
+
+
+class GroupCommitter:
+    """
+    Commits units of work from many connections together.
+
+    The first ``commit`` opens a window of ``window`` seconds; everything that
+    arrives in it (up to ``max_batch``) shares one transaction.  If the batch
+    fails, each unit is retried on its own so one bad write can't sink the rest.
+    """
+
+    def __init__(self, session_factory: Callable[[], Any], window: float = 0.005, max_batch: int = 64) -> None:
+        self.session_factory = session_factory
+        self.window    = window
+        self.max_batch = max_batch
+        self._queue: "asyncio.Queue[tuple[UnitOfWork, asyncio.Future]]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    async def commit(self, uow: UnitOfWork) -> None:
+        if not uow:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((uow, fut))
+        await fut
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._commit_batch(batch)
+
+    @timed(DB_SECONDS, op="group_commit")
+    async def _commit_batch(self, batch: list) -> None:
+        try:
+            async with self.session_factory() as db:
+                for uow, _ in batch:
+                    await uow.apply(db)
+                await db.commit()
+        except Exception:
+            logger.warning("group commit of %d units failed; retrying individually", len(batch))
+            for uow, fut in batch:
+                try:
+                    async with self.session_factory() as db:
+                        await uow.flush(db)
+                except Exception as exc:
+                    if not fut.done():
+                        fut.set_exception(exc)
+                    continue
+                if not fut.done():
+                    fut.set_result(None)
+            return
+        for uow, fut in batch:
+            uow.committed()
+            if not fut.done():
+                fut.set_result(None)
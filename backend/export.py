@@ -0,0 +1,240 @@
+# backend/export.py
+"""
+Bulk export of completed onboardings.
+
+Rows are read with a server-side cursor in fixed-size batches straight from
+``users ⋈ sessions ⟕ vehicles`` (no ORM objects, no relationship loading)
+and encoded incrementally, so memory stays flat however many users there are.
+
+    python -m backend.export --format csv --since 2024-01-01T00:00:00 -o out.csv
+"""
+import io
+import csv
+import sys
+import json
+import asyncio
+import argparse
+import logging
+from datetime import datetime
+from enum import Enum
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from backend.models import User, Vehicle, Session as SessionModel
+from backend.schemas import ConversationState
+
+logger = logging.getLogger(__name__)
+
+USER_COLUMNS = (
+    User.id, User.session_id, User.zip_code, User.full_name, User.email,
+    User.license_type, User.license_status, User.created_at, User.updated_at,
+)
+VEHICLE_COLUMNS = (
+    Vehicle.vin, Vehicle.year, Vehicle.make, Vehicle.model, Vehicle.body_type,
+    Vehicle.vehicle_use, Vehicle.blind_spot_warning, Vehicle.days_per_week,
+    Vehicle.one_way_miles, Vehicle.annual_mileage,
+)
+USER_FIELDS    = [c.key for c in USER_COLUMNS]
+VEHICLE_FIELDS = [c.key for c in VEHICLE_COLUMNS]
+FORMATS        = ("ndjson", "csv", "parquet")
+MEDIA_TYPES    = {"ndjson": "application/x-ndjson", "csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+# ------------------------------------------------------------------ #
+#  Reading
+# ------------------------------------------------------------------ #
+async def iter_completed(
+    conn: AsyncConnection,
+    since: Optional[datetime] = None,
+    batch_size: int = 1000,
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Yield batches of completed users, each ``{**user_fields, "vehicles": [...]}``.
+
+    *since* is an ``updated_at`` watermark: only users whose row or session
+    changed after it are returned.  ``updated_at`` in each record is the later
+    of the two, so the max seen is the next watermark.
+    """
+    query = (
+        select(*USER_COLUMNS, SessionModel.updated_at.label("session_updated_at"), *VEHICLE_COLUMNS,
+               Vehicle.id.label("vehicle_id"))
+        .join(SessionModel, SessionModel.user_id == User.id)
+        .outerjoin(Vehicle, Vehicle.user_id == User.id)
+        .where(SessionModel.current_state == ConversationState.completed.value)
+        .order_by(User.id, Vehicle.id)
+    )
+    if since is not None:
+        query = query.where(or_(User.updated_at > since, SessionModel.updated_at > since))
+
+    result = await conn.stream(query.execution_options(yield_per=batch_size))
+    batch: List[Dict[str, Any]] = []
+    current: Optional[Dict[str, Any]] = None
+    async for row in result:
+        m = row._mapping
+        if current is None or current["id"] != m["id"]:
+            if current is not None:
+                batch.append(current)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            current = {f: _plain(m[f]) for f in USER_FIELDS}
+            current["updated_at"] = _plain(max(m["updated_at"], m["session_updated_at"]))
+            current["vehicles"] = []
+        if m["vehicle_id"] is not None:
+            current["vehicles"].append({f: _plain(m[f]) for f in VEHICLE_FIELDS})
+    if current is not None:
+        batch.append(current)
+    if batch:
+        yield batch
+
+
+def flatten(records: Iterable[Dict[str, Any]]) -> Iterable[Dict[str, Any]]:
+    """One row per vehicle (or a single vehicle-less row) for tabular formats."""
+    for rec in records:
+        user = {f: rec[f] for f in USER_FIELDS}
+        for vehicle in rec["vehicles"] or [{}]:
+            yield {**user, **{f"vehicle_{f}": vehicle.get(f) for f in VEHICLE_FIELDS}}
+
+
+# ------------------------------------------------------------------ #
+#  Encoders: each turns batches into byte chunks
+# ------------------------------------------------------------------ #
+async def encode_ndjson(batches: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    async for batch in batches:
+        yield "".join(json.dumps(rec, separators=(",", ":")) + "\n" for rec in batch).encode()
+
+
+async def encode_csv(batches: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    columns = USER_FIELDS + [f"vehicle_{f}" for f in VEHICLE_FIELDS]
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=columns)
+    writer.writeheader()
+    async for batch in batches:
+        writer.writerows(flatten(batch))
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+class _ChunkSink:
+    """Write-only file object that hands written bytes back to the caller."""
+
+    def __init__(self) -> None:
+        self.chunks: List[bytes] = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        out, self.chunks = b"".join(self.chunks), []
+        return out
+
+
+async def encode_parquet(batches: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    """One row group per batch; needs the optional ``pyarrow`` package."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as exc:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)") from exc
+
+    types = {
+        "id": pa.int64(), "vehicle_year": pa.int32(), "vehicle_days_per_week": pa.int32(),
+        "vehicle_annual_mileage": pa.int64(), "vehicle_one_way_miles": pa.float64(),
+        "vehicle_blind_spot_warning": pa.bool_(),
+    }
+    names = USER_FIELDS + [f"vehicle_{f}" for f in VEHICLE_FIELDS]
+    schema = pa.schema([(name, types.get(name, pa.string())) for name in names])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    async for batch in batches:
+        rows = list(flatten(batch))
+        columns = {name: [r[name] for r in rows] for name in names}
+        writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+ENCODERS = {"ndjson": encode_ndjson, "csv": encode_csv, "parquet": encode_parquet}
+
+
+def format_available(fmt: str) -> bool:
+    if fmt != "parquet":
+        return fmt in ENCODERS
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+async def export_completed(
+    engine,
+    fmt: str = "ndjson",
+    since: Optional[datetime] = None,
+    batch_size: int = 1000,
+) -> AsyncIterator[bytes]:
+    """Byte chunks of the export in *fmt*, holding one connection for its duration."""
+    if fmt not in ENCODERS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    async with engine.connect() as conn:
+        async for chunk in ENCODERS[fmt](iter_completed(conn, since=since, batch_size=batch_size)):
+            if chunk:
+                yield chunk
+
+
+# ------------------------------------------------------------------ #
+#  CLI
+# ------------------------------------------------------------------ #
+async def _main(args: argparse.Namespace) -> None:
+    from backend.db import engine
+
+    since = datetime.fromisoformat(args.since) if args.since else None
+    out = open(args.output, "wb") if args.output != "-" else sys.stdout.buffer
+    try:
+        async for chunk in export_completed(engine, args.format, since=since, batch_size=args.batch_size):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+        await engine.dispose()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Export completed onboardings.")
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--since", help="only users updated after this ISO timestamp")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("-o", "--output", default="-", help="output file (default: stdout)")
+    asyncio.run(_main(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+# backend/flow.py
+"""
+The onboarding flow, declared once.
+
+Each ``Step`` names a state's prompt, validator, where a valid answer is
+stored (``Bind``), which state comes next (a fixed state or a ``Branch``)
+and the progress shown there.  ``Flow`` compiles the steps at import time
+into plain lookup tables, so per-message work is a few dict lookups.
+
+Adding a state means adding its enum value in ``schemas.py`` and a
+``Step`` here.
+"""
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+from backend.schemas import ConversationState
+import backend.models as models
+
+S = ConversationState
+
+ValidationResult = Tuple[bool, Any, Optional[str]]
+Validator = Callable[[str], ValidationResult]
+
+
+# ─── Validators ────────────────────────────────────────────────────── #
+ZIP_RE   = re.compile(r"\d{5}")
+EMAIL_RE = re.compile(r"[^@]+@[^@]+\.[^@]+")
+VIN_RE   = re.compile(r"[A-HJ-NPR-Z0-9]{17}")
+YEAR_RE  = re.compile(r"\d{4}", re.ASCII)  # str.isdigit() also takes "²", which int() rejects
+# several answers in one message: "94103, Jane Doe, jane@x.com"; a comma
+# before exactly three digits is a thousands separator ("12,000"), not a break
+ANSWER_SPLIT_RE = re.compile(r"\s*(?:[;\n]|,(?!\d{3}(?!\d)))\s*")
+LINE_BREAK_RE   = re.compile(r"\s*\n\s*")
+
+YES = frozenset({"yes", "y", "yeah", "sure", "ok", "okay"})
+NO  = frozenset({"no", "n", "nope", "nah"})
+VEHICLE_USES     = frozenset(v.value for v in models.VehicleUse)
+LICENSE_TYPES    = frozenset(t.value for t in models.LicenseType)
+LICENSE_STATUSES = frozenset(s.value for s in models.LicenseStatus)
+
+
+def validate_zip(text: str) -> ValidationResult:
+    txt = text.strip()
+    if ZIP_RE.fullmatch(txt):
+        return True, txt, None
+    return False, "", "Please provide a valid 5-digit zip code."
+
+
+def validate_name(text: str) -> ValidationResult:
+    txt = text.strip()
+    if len(txt.split()) >= 2:
+        return True, txt, None
+    return False, "", "Please provide your full name (first and last)."
+
+
+def validate_email(text: str) -> ValidationResult:
+    txt = text.strip().lower()
+    if EMAIL_RE.fullmatch(txt):
+        return True, txt, None
+    return False, "", "Please provide a valid email address."
+
+
+def validate_vehicle_info(text: str) -> ValidationResult:
+    vin = text.strip().upper()
+    if VIN_RE.fullmatch(vin):
+        return True, {"vin": vin}, None
+
+    parts = text.strip().split(maxsplit=2)
+    if len(parts) == 3 and YEAR_RE.fullmatch(parts[0]):
+        year = int(parts[0])
+        if 1900 <= year <= datetime.utcnow().year + 1:
+            return True, {
+                "year": year,
+                "make": parts[1].title(),
+                "body_type": parts[2].title(),
+            }, None
+    return False, {}, "Please provide either a 17-character VIN or 'Year Make Body-Type'."
+
+
+def _choice(options: frozenset, error: str) -> Validator:
+    def validate(text: str) -> ValidationResult:
+        txt = text.strip().lower()
+        if txt in options:
+            return True, txt, None
+        return False, "", error
+    return validate
+
+
+def validate_yes_no(text: str) -> ValidationResult:
+    txt = text.strip().lower()
+    if txt in YES:
+        return True, True, None
+    if txt in NO:
+        return True, False, None
+    return False, False, "Please answer Yes or No."
+
+
+def _int_range(lo: int, hi: int, error: str, strip_commas: bool = False) -> Validator:
+    def validate(text: str) -> ValidationResult:
+        txt = text.strip()
+        if strip_commas:
+            txt = txt.replace(",", "")
+        try:
+            n = int(txt)
+        except ValueError:
+            return False, 0, error
+        if lo <= n <= hi:
+            return True, n, None
+        return False, 0, error
+    return validate
+
+
+validate_vehicle_use    = _choice(VEHICLE_USES, "Please choose: commuting, commercial, farming, or business.")
+validate_license_type   = _choice(LICENSE_TYPES, "Please choose: Foreign, Personal, or Commercial.")
+validate_license_status = _choice(LICENSE_STATUSES, "Please choose: Valid or Suspended.")
+validate_days    = _int_range(1, 7, "Please enter a number between 1 and 7.")
+validate_miles   = _int_range(1, 999, "Please enter the number of miles (1-999).")
+validate_mileage = _int_range(1, 499_999, "Please enter annual mileage (e.g., 12000).", strip_commas=True)
+
+
+# ─── Declarations ──────────────────────────────────────────────────── #
+@dataclass(frozen=True)
+class Bind:
+    """Where a valid answer goes: a user column, or a field of the vehicle being collected.
+
+    ``target="vehicle"`` with no ``field`` starts a new vehicle from the
+    parsed dict; ``save_vehicle`` records the finished vehicle and clears it.
+    """
+    target: str                                   # "user" | "vehicle"
+    field: Optional[str] = None
+    convert: Optional[Callable[[Any], Any]] = None
+    save_vehicle: bool = False
+
+
+@dataclass(frozen=True)
+class Branch:
+    """Next state chosen by the answer (``on=None``) or by a field of the current vehicle."""
+    cases: Mapping[Any, ConversationState]
+    default: ConversationState
+    on: Optional[str] = None
+
+    @property
+    def outcomes(self) -> Tuple[ConversationState, ...]:
+        # the default is listed first: it is the common path for every branch in the flow
+        return tuple(dict.fromkeys((self.default, *self.cases.values())))
+
+
+@dataclass(frozen=True)
+class Step:
+    state: ConversationState
+    prompt: str
+    next: Union[ConversationState, Branch]
+    progress: float
+    validator: Optional[Validator] = None
+    bind: Optional[Bind] = None
+
+
+def user(field: str, convert: Optional[Callable[[Any], Any]] = None) -> Bind:
+    return Bind("user", field, convert)
+
+
+def vehicle(field: Optional[str] = None, save: bool = False) -> Bind:
+    return Bind("vehicle", field, save_vehicle=save)
+
+
+ONBOARDING: Sequence[Step] = (
+    Step(S.start, "Hello! I'll help you with your insurance onboarding. Let's start by getting your zip code.",
+         next=S.collecting_zip, progress=0),
+    Step(S.collecting_zip, "What's your 5-digit zip code?",
+         next=S.collecting_name, progress=10, validator=validate_zip, bind=user("zip_code")),
+    Step(S.collecting_name, "Great! What's your full name?",
+         next=S.collecting_email, progress=20, validator=validate_name, bind=user("full_name")),
+    Step(S.collecting_email, "Thanks! What's your email address?",
+         next=S.collecting_vehicle_info, progress=30, validator=validate_email, bind=user("email")),
+    # legacy sessions may still sit here; it has no question of its own, so they resume at the next step
+    Step(S.vehicle_intro, "",
+         next=S.collecting_vehicle_info, progress=35),
+    Step(S.collecting_vehicle_info, "Perfect! Please provide either your VIN or Year Make Body-Type (e.g. '2022 Honda Civic').",
+         next=S.collecting_vehicle_use, progress=40, validator=validate_vehicle_info, bind=vehicle()),
+    Step(S.collecting_vehicle_use, "How do you primarily use this vehicle? (commuting, commercial, farming, or business)",
+         next=S.collecting_blind_spot, progress=50, validator=validate_vehicle_use, bind=vehicle("vehicle_use")),
+    Step(S.collecting_blind_spot, "Does this vehicle have blind spot warning? (Yes or No)",
+         next=Branch({models.VehicleUse.commuting.value: S.collecting_commute_days},
+                     default=S.collecting_annual_mileage, on="vehicle_use"),
+         progress=60, validator=validate_yes_no, bind=vehicle("blind_spot_warning")),
+    Step(S.collecting_commute_days, "How many days per week do you commute with this vehicle?",
+         next=S.collecting_commute_miles, progress=65, validator=validate_days, bind=vehicle("days_per_week")),
+    Step(S.collecting_commute_miles, "What's your one-way distance to work/school in miles?",
+         next=S.ask_more_vehicles, progress=70, validator=validate_miles, bind=vehicle("one_way_miles", save=True)),
+    Step(S.collecting_annual_mileage, "What's the estimated annual mileage for this vehicle?",
+         next=S.ask_more_vehicles, progress=70, validator=validate_mileage, bind=vehicle("annual_mileage", save=True)),
+    Step(S.ask_more_vehicles, "Would you like to add another vehicle? (Yes or No)",
+         next=Branch({True: S.collecting_vehicle_info}, default=S.collecting_license_type),
+         progress=75, validator=validate_yes_no),
+    Step(S.collecting_license_type, "What type of license do you have? (Foreign, Personal, or Commercial)",
+         next=Branch({models.LicenseType.foreign.value: S.completed}, default=S.collecting_license_status),
+         progress=85, validator=validate_license_type, bind=user("license_type", models.LicenseType)),
+    Step(S.collecting_license_status, "What's your license status? (Valid or Suspended)",
+         next=S.completed, progress=95, validator=validate_license_status,
+         bind=user("license_status", models.LicenseStatus)),
+    Step(S.completed, "Thank you! Your onboarding is complete.",
+         next=S.completed, progress=100),
+)
+
+
+# ─── Compiled flow ─────────────────────────────────────────────────── #
+class Flow:
+    """Lookup tables compiled from a sequence of ``Step``s."""
+
+    def __init__(self, steps: Sequence[Step]) -> None:
+        self.steps:      Dict[ConversationState, Step] = {}
+        self.prompts:    Dict[ConversationState, str] = {}
+        self.validators: Dict[ConversationState, Validator] = {}
+        self.bindings:   Dict[ConversationState, Bind] = {}
+        self.progress:   Dict[ConversationState, float] = {}
+        self.static_next: Dict[ConversationState, ConversationState] = {}
+        self.branches:   Dict[ConversationState, Branch] = {}
+        self.candidates: Dict[ConversationState, Tuple[ConversationState, ...]] = {}
+        self.pass_through: Dict[ConversationState, ConversationState] = {}
+
+        for step in steps:
+            if step.state in self.steps:
+                raise ValueError(f"duplicate step for {step.state.value}")
+            self.steps[step.state]    = step
+            self.prompts[step.state]  = step.prompt
+            self.progress[step.state] = step.progress
+            if step.validator is not None:
+                self.validators[step.state] = step.validator
+            if step.bind is not None:
+                self.bindings[step.state] = step.bind
+            if isinstance(step.next, Branch):
+                self.branches[step.state] = step.next
+                outcomes = step.next.outcomes
+            else:
+                self.static_next[step.state] = step.next
+                outcomes = (step.next,)
+                if not step.prompt:
+                    self.pass_through[step.state] = step.next
+            self.candidates[step.state] = tuple(s for s in outcomes if s != step.state)
+
+        targets = set(self.static_next.values())
+        for branch in self.branches.values():
+            targets.update(branch.outcomes)
+        missing = targets - set(self.steps)
+        if missing:
+            raise ValueError(f"transitions to undeclared states: {sorted(s.value for s in missing)}")
+
+    # ------------------------------------------------------------------ #
+    def validate(self, state: ConversationState, text: str) -> ValidationResult:
+        validator = self.validators.get(state)
+        if validator is None:
+            return True, text, None
+        return validator(text)
+
+    def next_state(self, state: ConversationState, parsed: Any, state_data: Dict) -> ConversationState:
+        nxt = self.static_next.get(state)
+        if nxt is not None:
+            return nxt
+        branch = self.branches[state]
+        key = parsed if branch.on is None else state_data.get("current_vehicle", {}).get(branch.on)
+        return branch.cases.get(key, branch.default)
+
+    def resume_state(self, state: ConversationState) -> ConversationState:
+        """The state to continue a stored session in: steps without a question are passed through."""
+        while state in self.pass_through:
+            state = self.pass_through[state]
+        return state
+
+    def candidate_next_states(self, state: ConversationState, state_data: Dict) -> List[ConversationState]:
+        branch = self.branches.get(state)
+        if branch is not None and branch.on is not None:
+            # decided by data already collected, so there is exactly one outcome
+            return [self.next_state(state, None, state_data)]
+        return list(self.candidates.get(state, ()))
+
+    def split_answers(self, state: ConversationState, text: str) -> List[str]:
+        """The answers in one message, in order; a single answer unless the first piece is valid for *state*."""
+        parts = [p for p in ANSWER_SPLIT_RE.split(text.strip()) if p]
+        if len(parts) > 1 and self.validate(state, parts[0])[0]:
+            return parts
+        return [text.strip()]
+
+    def check(self, state: ConversationState, text: str) -> ValidationResult:
+        """
+        Validate *text* against *state*.  Messages sent in quick succession
+        arrive one per line: the first of them that answers *state* decides,
+        otherwise the newest one's error is returned.
+        """
+        result: ValidationResult = (False, "", None)
+        for message in LINE_BREAK_RE.split(text.strip()):
+            result = self.validate(state, self.split_answers(state, message)[0])
+            if result[0]:
+                break
+        return result
+
+    def fill(self, state: ConversationState, text: str, snap, uow) -> Tuple[ConversationState, int]:
+        """
+        Apply the answers in *text* to consecutive states starting at *state*.
+        Each line is a message of its own: its answers stop at the first one
+        that doesn't fit, and a message that doesn't fit at all is skipped
+        ("Jane", then "Jane Doe"), so later ones are tried against the same
+        state.  Returns the first state still to ask and how many answers
+        were used.
+        """
+        used = 0
+        for message in LINE_BREAK_RE.split(text.strip()):
+            for answer in self.split_answers(state, message):
+                if state not in self.validators:
+                    return state, used
+                ok, parsed, _ = self.validate(state, answer)
+                if not ok:
+                    break
+                self.apply(state, parsed, snap, uow)
+                state = self.next_state(state, parsed, snap.state_data)
+                used += 1
+        return state, used
+
+    def apply(self, state: ConversationState, parsed: Any, snap, uow) -> None:
+        """Store a valid answer on the session snapshot; finished vehicles are recorded on *uow*."""
+        bind = self.bindings.get(state)
+        if bind is None:
+            return
+        value = bind.convert(parsed) if bind.convert else parsed
+        if bind.target == "user":
+            snap.update_user(**{bind.field: value})
+            return
+        state_data = snap.state_data
+        if bind.field is None:
+            state_data["current_vehicle"] = value
+        else:
+            state_data.setdefault("current_vehicle", {})[bind.field] = value
+        if bind.save_vehicle:
+            uow.save_vehicle(state_data["current_vehicle"])
+            state_data["current_vehicle"] = {}
+
+
+FLOW = Flow(ONBOARDING)
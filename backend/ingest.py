@@ -0,0 +1,416 @@
+# backend/ingest.py
+"""
+Bulk ingestion of partner leads.
+
+Rows are streamed in (CSV or NDJSON), each lead is replayed through the
+onboarding flow's validators and bindings exactly as if it had been typed
+into the chat (no LLM involved), and valid leads are written with
+multi-row INSERTs, one transaction per batch.  Every lead gets a session
+that resumes the chat at its first missing field; a per-row report is
+streamed back, so memory stays bounded by the batch size.
+
+Lead shape (NDJSON, or CSV with ``vehicle_``-prefixed columns, one row per
+vehicle; consecutive CSV rows with the same ``session_id`` form one lead)::
+
+    {"session_id": "optional", "zip_code": "94103", "full_name": "Jane Doe",
+     "email": "jane@x.com", "license_type": "personal", "license_status": "valid",
+     "vehicles": [{"vin": "...", "vehicle_use": "commuting", "blind_spot_warning": "yes",
+                   "days_per_week": 5, "one_way_miles": 12}]}
+
+A vehicle is identified by ``vin``, by ``year``/``make``/``body_type``, or
+by free text in ``vehicle`` ("2022 Honda Civic").
+
+    python -m backend.ingest leads.csv --report report.ndjson
+"""
+import csv
+import sys
+import json
+import uuid
+import codecs
+import asyncio
+import argparse
+import logging
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert, select
+
+from backend.flow import FLOW, Flow, validate_yes_no
+from backend.models import User, Vehicle, Session as SessionModel, VehicleUse
+from backend.schemas import ConversationState
+
+logger = logging.getLogger(__name__)
+
+S = ConversationState
+
+FORMATS       = ("csv", "ndjson")
+USER_FIELDS   = ("zip_code", "full_name", "email", "license_type", "license_status")
+VEHICLE_KEYS  = frozenset({"vin", "year", "make", "model", "body_type", "vehicle", "vehicle_use",
+                           "blind_spot_warning", "days_per_week", "one_way_miles", "annual_mileage"})
+VEHICLE_CHUNK = 1000
+_BOOL_TEXT    = {"true": "yes", "false": "no", "1": "yes", "0": "no"}
+
+
+# ------------------------------------------------------------------ #
+#  Parsing
+# ------------------------------------------------------------------ #
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode a byte stream into lines without holding more than one partial line."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    tail = ""
+    async for chunk in chunks:
+        tail += decoder.decode(chunk)
+        *lines, tail = tail.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    tail += decoder.decode(b"", final=True)
+    if tail.strip():
+        yield tail.rstrip("\r")
+
+
+async def parse_ndjson(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Any]]:
+    """``(row number, lead dict or error string)``."""
+    row = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        row += 1
+        try:
+            lead = json.loads(line)
+        except ValueError as exc:
+            yield row, f"invalid JSON: {exc}"
+            continue
+        yield row, lead if isinstance(lead, dict) else "expected a JSON object"
+
+
+async def parse_csv(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Any]]:
+    """Group ``vehicle_*`` rows sharing a ``session_id`` into one lead (records must not span lines)."""
+    header: Optional[List[str]] = None
+    current: Optional[Dict[str, Any]] = None
+    first_row = row = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        values = next(csv.reader([line]))
+        if header is None:
+            header = [h.strip() for h in values]
+            continue
+        row += 1
+        record = {k: v.strip() for k, v in zip(header, values) if v is not None and v.strip() != ""}
+        vehicle = {}
+        for column in list(record):
+            # "vehicle_year" and "year" both work, as do the exporter's "vehicle_vehicle_use" and "vehicle_use"
+            key = column[len("vehicle_"):] if column.startswith("vehicle_") else column
+            if key in VEHICLE_KEYS or column in VEHICLE_KEYS:
+                vehicle[key if key in VEHICLE_KEYS else column] = record.pop(column)
+        key = record.get("session_id")
+        if current is not None and key and key == current.get("session_id"):
+            if vehicle:
+                current["vehicles"].append(vehicle)
+            continue
+        if current is not None:
+            yield first_row, current
+        current, first_row = {**record, "vehicles": [vehicle] if vehicle else []}, row
+    if current is not None:
+        yield first_row, current
+
+
+PARSERS = {"csv": parse_csv, "ndjson": parse_ndjson}
+
+
+# ------------------------------------------------------------------ #
+#  Replaying a lead through the flow
+# ------------------------------------------------------------------ #
+class _LeadState:
+    """Stands in for both the session snapshot and the unit of work while a lead is replayed."""
+
+    def __init__(self) -> None:
+        self.user_fields: Dict[str, Any] = {}
+        self.state_data: Dict[str, Any] = {}
+        self.vehicles: List[Dict[str, Any]] = []
+
+    def update_user(self, **fields) -> None:
+        self.user_fields.update(fields)
+
+    def save_vehicle(self, vehicle: Dict[str, Any]) -> None:
+        self.vehicles.append(dict(vehicle))
+
+
+class LeadPlan:
+    def __init__(self, row: int, session_id: Optional[str] = None, supplied_id: bool = False) -> None:
+        self.row        = row
+        self.session_id = session_id
+        self.supplied_id = supplied_id  # False when session_id was generated here
+        self.errors: List[Dict[str, str]] = []
+        self.state      = _LeadState()
+        self.resume     = S.collecting_zip
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def report(self, status: str) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"row": self.row, "status": status}
+        if self.session_id:
+            out["session_id"] = self.session_id
+        if status == "created":
+            out["resume_state"] = self.resume.value
+            out["vehicles"] = len(self.state.vehicles)
+        if self.errors:
+            out["errors"] = self.errors
+        return out
+
+
+def _text(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "yes" if value else "no"
+    text = str(value).strip()
+    return text or None
+
+
+def _vehicle_text(vehicle: Dict[str, Any]) -> Optional[str]:
+    if vehicle.get("vin"):
+        return _text(vehicle["vin"])
+    if vehicle.get("vehicle"):
+        return _text(vehicle["vehicle"])
+    parts = [vehicle.get(k) for k in ("year", "make", "body_type")]
+    return " ".join(str(p).strip() for p in parts) if all(parts) else None
+
+
+class LeadValidator:
+    """Replays leads through a compiled ``Flow`` (the same tables the chat uses)."""
+
+    def __init__(self, flow: Flow = FLOW) -> None:
+        self.flow = flow
+        # which state asks for which field
+        self.user_states: Dict[S, str] = {}
+        self.vehicle_states: Dict[S, Optional[str]] = {}
+        for state, bind in flow.bindings.items():
+            (self.user_states if bind.target == "user" else self.vehicle_states)[state] = bind.field
+
+    def _answer(self, state: S, lead: Dict[str, Any], vehicles: List[Dict[str, Any]], done: int) -> Tuple[Optional[str], str]:
+        """The lead's answer to *state* as chat text, and the field name for error reports."""
+        answer, field = self._raw_answer(state, lead, vehicles, done)
+        if answer is not None and self.flow.validators.get(state) is validate_yes_no:
+            answer = _BOOL_TEXT.get(answer.lower(), answer)  # files say true/false, people say yes/no
+        return answer, field
+
+    def _raw_answer(self, state: S, lead: Dict[str, Any], vehicles: List[Dict[str, Any]], done: int) -> Tuple[Optional[str], str]:
+        if state in self.user_states:
+            field = self.user_states[state]
+            return _text(lead.get(field)), field
+        if state in self.vehicle_states:
+            if done >= len(vehicles):
+                return None, "vehicles"
+            field = self.vehicle_states[state]
+            if field is None:
+                return _vehicle_text(vehicles[done]), f"vehicles[{done}]"
+            return _text(vehicles[done].get(field)), f"vehicles[{done}].{field}"
+        if state == S.ask_more_vehicles:
+            if done < len(vehicles):
+                return "yes", "vehicles"
+            # only close the vehicle list when the lead moves on to the license
+            return ("no" if _text(lead.get("license_type")) else None), "vehicles"
+        return None, ""
+
+    def plan(self, row: int, lead: Any) -> LeadPlan:
+        if not isinstance(lead, dict):
+            plan = LeadPlan(row)
+            plan.errors.append({"field": "", "error": str(lead)})
+            return plan
+
+        session_id = _text(lead.get("session_id"))
+        plan = LeadPlan(row, session_id or f"lead-{uuid.uuid4().hex}", supplied_id=session_id is not None)
+        vehicles = lead.get("vehicles") or []
+        if not isinstance(vehicles, list) or not all(isinstance(v, dict) for v in vehicles):
+            plan.errors.append({"field": "vehicles", "error": "vehicles must be a list of objects"})
+            return plan
+
+        st = plan.state
+        state = self.flow.next_state(S.start, None, st.state_data)
+        # every answer either consumes a field or stops the walk, so this ends
+        while state != S.completed:
+            answer, field = self._answer(state, lead, vehicles, len(st.vehicles))
+            if answer is None:
+                break
+            ok, parsed, err = self.flow.validate(state, answer)
+            if not ok:
+                plan.errors.append({"field": field, "error": err})
+                break
+            self.flow.apply(state, parsed, st, st)
+            state = self.flow.next_state(state, parsed, st.state_data)
+        plan.resume = state
+
+        if not plan.errors and not st.user_fields and not st.vehicles and not st.state_data.get("current_vehicle"):
+            plan.errors.append({"field": "", "error": "no usable fields"})
+        return plan
+
+
+# ------------------------------------------------------------------ #
+#  Writing
+# ------------------------------------------------------------------ #
+def _vehicle_row(user_id: int, vehicle: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+    row = {f: vehicle.get(f) for f in ("vin", "year", "make", "model", "body_type", "blind_spot_warning",
+                                       "days_per_week", "one_way_miles", "annual_mileage")}
+    row["vehicle_use"] = VehicleUse(vehicle["vehicle_use"]) if vehicle.get("vehicle_use") else None
+    row.update(user_id=user_id, created_at=now)
+    return row
+
+
+async def write_batch(conn, plans: List[LeadPlan]) -> None:
+    """Insert users, sessions and vehicles for *plans* with one multi-row INSERT each."""
+    now = datetime.utcnow()
+    users = [
+        {"session_id": p.session_id, "created_at": now, "updated_at": now,
+         **{f: p.state.user_fields.get(f) for f in USER_FIELDS}}
+        for p in plans
+    ]
+    result = await conn.execute(insert(User).values(users).returning(User.id, User.session_id))
+    ids = {sid: uid for uid, sid in result.all()}
+
+    await conn.execute(insert(SessionModel).values([
+        {"user_id": ids[p.session_id], "current_state": p.resume.value,
+         "state_data": p.state.state_data, "created_at": now, "updated_at": now}
+        for p in plans
+    ]))
+    vehicles = [_vehicle_row(ids[p.session_id], v, now) for p in plans for v in p.state.vehicles]
+    # leads can carry several vehicles; keep each statement under driver parameter limits
+    for start in range(0, len(vehicles), VEHICLE_CHUNK):
+        await conn.execute(insert(Vehicle).values(vehicles[start:start + VEHICLE_CHUNK]))
+
+
+async def ingest(
+    engine,
+    rows: AsyncIterator[Tuple[int, Any]],
+    batch_size: int = 500,
+    validator: Optional[LeadValidator] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Validate and insert parsed *rows*; yields one report dict per row and a
+    final ``{"summary": {...}}``.
+
+    Each batch commits on its own, so a failure loses at most one batch
+    (whose rows are then reported as ``failed``).
+    """
+    validator = validator or LeadValidator()
+    counts = {"created": 0, "rejected": 0, "failed": 0}
+    batch: List[LeadPlan] = []
+
+    async def flush() -> AsyncIterator[Dict[str, Any]]:
+        pending = list(batch)
+        batch.clear()
+        try:
+            async with engine.begin() as conn:
+                taken = set((await conn.execute(
+                    select(User.session_id).where(User.session_id.in_([p.session_id for p in pending]))
+                )).scalars())
+                fresh = []
+                for p in pending:
+                    if p.session_id in taken:
+                        p.errors.append({"field": "session_id", "error": "session already exists"})
+                    else:
+                        fresh.append(p)
+                if fresh:
+                    await write_batch(conn, fresh)
+        except Exception as exc:
+            logger.exception("lead batch failed")
+            for p in pending:
+                if p.ok:
+                    p.errors.append({"field": "", "error": f"batch failed: {type(exc).__name__}"})
+                    counts["failed"] += 1
+                    yield p.report("failed")
+                else:
+                    counts["rejected"] += 1
+                    yield p.report("rejected")
+            return
+        for p in pending:
+            status = "created" if p.ok else "rejected"
+            counts[status] += 1
+            yield p.report(status)
+
+    # supplied ids in the open batch; earlier batches are already in the table,
+    # where flush() finds them, so this never holds more than batch_size ids
+    seen_ids = set()
+    async for row, lead in rows:
+        plan = validator.plan(row, lead)
+        if plan.ok and plan.supplied_id and plan.session_id in seen_ids:
+            plan.errors.append({"field": "session_id", "error": "duplicate session_id in input"})
+        if not plan.ok:
+            counts["rejected"] += 1
+            yield plan.report("rejected")
+            continue
+        if plan.supplied_id:
+            seen_ids.add(plan.session_id)
+        batch.append(plan)
+        if len(batch) >= batch_size:
+            seen_ids.clear()
+            async for report in flush():
+                yield report
+    if batch:
+        async for report in flush():
+            yield report
+    yield {"summary": counts}
+
+
+async def ingest_stream(
+    engine,
+    chunks: AsyncIterator[bytes],
+    fmt: str = "csv",
+    batch_size: int = 500,
+    errors_only: bool = False,
+) -> AsyncIterator[bytes]:
+    """NDJSON report bytes for a raw upload in *fmt*."""
+    if fmt not in PARSERS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    async for report in ingest(engine, PARSERS[fmt](iter_lines(chunks)), batch_size=batch_size):
+        if errors_only and report.get("status") == "created":
+            continue
+        yield (json.dumps(report, separators=(",", ":")) + "\n").encode()
+
+
+# ------------------------------------------------------------------ #
+#  CLI
+# ------------------------------------------------------------------ #
+async def _file_chunks(path: str, size: int = 1 << 16) -> AsyncIterator[bytes]:
+    f = open(path, "rb") if path != "-" else sys.stdin.buffer
+    try:
+        while True:
+            chunk = await asyncio.to_thread(f.read, size)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+
+
+async def _main(args: argparse.Namespace) -> None:
+    from backend.db import engine, init_db
+
+    fmt = args.format or ("ndjson" if args.input.endswith((".ndjson", ".jsonl")) else "csv")
+    await init_db()
+    out = open(args.report, "wb") if args.report != "-" else sys.stdout.buffer
+    try:
+        async for line in ingest_stream(engine, _file_chunks(args.input), fmt,
+                                        batch_size=args.batch_size, errors_only=args.errors_only):
+            out.write(line)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+        await engine.dispose()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Bulk-ingest partner leads.")
+    parser.add_argument("input", help="CSV or NDJSON file ('-' for stdin)")
+    parser.add_argument("--format", choices=FORMATS, help="default: from the file extension")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--report", default="-", help="NDJSON per-row report (default: stdout)")
+    parser.add_argument("--errors-only", action="store_true", help="omit rows that were created")
+    asyncio.run(_main(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
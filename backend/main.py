@@ -1,22 +1,41 @@
 # backend/main.py
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from contextlib import asynccontextmanager
-import json
+import asyncio
 import logging
 import os
+import time
 import base64
+import hmac
+from datetime import datetime
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple, Union
 
 from dotenv import load_dotenv
 from websockets.exceptions import ConnectionClosedError
 
-from backend.db import init_db, get_session
-from backend.schemas import WebSocketMessage, ConversationState, UserResponse
+from backend.db import init_db, get_session, session_scope, pool_stats, engine as db_engine, DATABASE_URL
+from backend.schemas import WebSocketMessage, ConversationState, UserResponse, MessageOut, MessagePage
 from backend.conversation_engine import ConversationEngine
-import backend.models as models
 from backend.openai_client import OpenAIClient
+from backend.reply_generator import PromptPool, build_generator
+from backend.speculation import Speculator
+import backend.archive as archive
+import backend.codec as codec
 import backend.crud as crud
+import backend.export as export
+import backend.ingest as ingest
+from backend.broadcast import PgListener, build_broadcaster
+from backend.ownership import SessionLease, TAKEN_OVER
+import backend.ownership as ownership
+from backend.pipeline import InboundQueue, SessionWriter, Superseded, TaskGroup
+from backend.audio_upload import AudioUpload
+from backend.session_cache import SessionSnapshot, load_snapshot
+import backend.metrics as metrics
+from backend.metrics import TURN_STAGE_SECONDS, OPEN_SOCKETS, FIELDS_PER_TURN, INBOUND
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
@@ -29,7 +48,20 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     await init_db()
     logger.info("Database initialized")
+    # greetings are generated once, off the request path
+    warm = asyncio.create_task(greetings.warm())
+    listener = PgListener(broadcaster, DATABASE_URL) if broadcaster.mode == "postgres" else None
+    if listener is not None:
+        listener.start()
+    archiver = (
+        asyncio.create_task(archive.run_periodically(db_engine, session_scope)) if archive.ARCHIVE_INTERVAL > 0 else None
+    )
     yield
+    warm.cancel()
+    if archiver is not None:
+        archiver.cancel()
+    if listener is not None:
+        await listener.stop()
     logger.info("Shutting down")
 
 app = FastAPI(title="Bind IQ Chatbot", version="1.0.0", lifespan=lifespan)
@@ -43,101 +75,362 @@ app.add_middleware(
 
 engine    = ConversationEngine()
 ai_client = OpenAIClient()  # avoid shadowing name
+replies   = build_generator(ai_client)  # REPLY_MODE: llm | template | hybrid
+greetings = PromptPool(replies, ConversationState.start, engine.get_prompt(ConversationState.start),
+                       size=int(os.getenv("GREETING_POOL_SIZE", "4")))
+# progress frames depend only on the state, so each is encoded once
+STATE_UPDATE_FRAMES = {
+    state: codec.dumps({
+        "type": "state_update",
+        "data": {"current_state": state.value, "progress": engine.calculate_progress(state)},
+    })
+    for state in ConversationState
+}
+# committed turns fan out to /ws/observe (BROADCAST_MODE: local | postgres | off);
+# observers must pass ?token=OBSERVE_TOKEN, and none are accepted while it is unset
+broadcaster = build_broadcaster()
+OBSERVE_TOKEN = os.getenv("OBSERVE_TOKEN", "")
+
+# newest connection per session id in this process: a reconnect waits for the
+# old socket's writes and closes it without waiting for its next write
+connections: Dict[str, Tuple[SessionWriter, asyncio.Event]] = {}
+
+# bulk data endpoints (exports, lead ingestion) need "Authorization: Bearer <ADMIN_TOKEN>"; unset disables them
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# stream replies as bot_message_delta frames; clients may override with ?stream=0/1
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "0") == "1"
+
+# text-to-speech is opt-in per connection (?tts=1); this only changes the default
+TTS_DEFAULT = os.getenv("TTS_DEFAULT", "0") == "1"
+
+# voice uploads: hard cap per message, and how much stays in memory before spooling to disk
+AUDIO_MAX_BYTES   = int(os.getenv("AUDIO_MAX_BYTES", str(10 * 1024 * 1024)))
+AUDIO_SPOOL_BYTES = int(os.getenv("AUDIO_SPOOL_BYTES", str(512 * 1024)))
+
+# per-connection input buffer: queued turns before input is shed, and how
+# many quick consecutive messages are merged into one turn
+INBOUND_MAX_DEPTH = int(os.getenv("INBOUND_MAX_DEPTH", "4"))
+INBOUND_MAX_MERGE = int(os.getenv("INBOUND_MAX_MERGE", "5"))
+
+# client message ids remembered per connection, so resent messages are acknowledged, not re-run
+SEEN_IDS_MAX = int(os.getenv("SEEN_IDS_MAX", "256"))
+
+# replies generated ahead of the user's answer, per connection (0 disables)
+SPECULATION_BUDGET = int(os.getenv("SPECULATION_BUDGET", "30"))
+
+# >0 batches turn commits from all connections into shared transactions
+GROUP_COMMIT_MS = float(os.getenv("DB_GROUP_COMMIT_MS", "0"))
+group_committer = crud.GroupCommitter(session_scope, window=GROUP_COMMIT_MS / 1000) if GROUP_COMMIT_MS > 0 else None
+
+# pool occupancy is sampled when /metrics is scraped
+DB_POOL = metrics.Gauge(
+    "bindiq_db_pool", "Connection pool occupancy and checkout waits.", ("stat",),
+    callback=lambda: {(k,): v for k, v in pool_stats().items() if isinstance(v, (int, float))},
+)
 
 # ------------------------------------------------------------------ #
 #  WebSocket endpoint
 # ------------------------------------------------------------------ #
 @app.websocket("/ws")
-async def websocket_endpoint(ws: WebSocket, db: AsyncSession = Depends(get_session)):
+async def websocket_endpoint(ws: WebSocket):
     await ws.accept()
+    OPEN_SOCKETS.inc()
     session_id = ws.query_params.get("session") or ws.client.host
+    stream     = ws.query_params.get("stream", "1" if STREAM_REPLIES else "0") == "1"
+    tts        = ws.query_params.get("tts", "1" if TTS_DEFAULT else "0") == "1"
+    last_seq   = ws.query_params.get("last_seq", "")
+    last_seq   = int(last_seq) if last_seq.isascii() and last_seq.isdigit() else None  # the client has every message up to here
+
+    # DB writes and TTS run beside the conversation, never in front of it
+    writer     = SessionWriter(name=session_id)
+    lease      = SessionLease(session_id) if ownership.ENABLED else None
+    taken_over = lease.lost if lease is not None else asyncio.Event()  # set once a newer connection has the session
+    events     = broadcaster.sink(session_id)
+    previous   = connections.get(session_id)
+    connections[session_id] = (writer, taken_over)
+    background = TaskGroup()
+    send_lock  = asyncio.Lock()
+    upload: Optional[AudioUpload] = None
+    inbound    = InboundQueue(max_depth=INBOUND_MAX_DEPTH, max_merge=INBOUND_MAX_MERGE)
+    reader: Optional[asyncio.Task] = None
+    seen: "OrderedDict[str, Optional[int]]" = OrderedDict()  # client message id -> seq (None while queued)
+    speech: Optional[asyncio.Task] = None
+    speculator = Speculator(
+        lambda st, name: replies.speculate(st, engine.get_prompt(st), user_name=name),
+        budget=SPECULATION_BUDGET,
+    )
 
     try:
-        user = await crud.get_or_create_user(db, session_id)
-
-        async def safe_send(payload: dict):
+        def remember(client_id: str, seq: Optional[int]) -> None:
+            seen[client_id] = seq
+            seen.move_to_end(client_id)
+            while len(seen) > SEEN_IDS_MAX:
+                seen.popitem(last=False)
+
+        async def safe_send(payload: Union[dict, str, bytes]):
+            """*payload* is a frame dict, an already encoded text frame or audio bytes."""
             try:
-                await ws.send_json(payload)
+                async with send_lock:
+                    if isinstance(payload, bytes):
+                        await ws.send_bytes(payload)
+                    else:
+                        await ws.send_text(payload if isinstance(payload, str) else codec.dumps(payload))
             except (WebSocketDisconnect, ConnectionClosedError):
                 raise WebSocketDisconnect()
 
+        # ---------- ownership ----------
+        # the newest connection wins: an older socket here is told to go now,
+        # one on another worker finds out at its next write
+        if previous is not None:
+            prev_writer, prev_taken_over = previous
+            prev_taken_over.set()
+            await prev_writer.flush()
+        if lease is not None:
+            await lease.acquire()
+
+        async def close_when_taken_over():
+            await taken_over.wait()
+            logger.info("session %s taken over by a newer connection", session_id)
+            try:
+                await safe_send({"type": "session_taken_over",
+                                 "content": "This chat was opened somewhere else, so it was closed here."})
+                await ws.close(code=TAKEN_OVER)
+            except Exception:
+                pass
+            inbound.close()  # don't wait on the client to acknowledge the close
+
+        background.spawn(close_when_taken_over())
+
+        # a (re)connect always re-reads Postgres, once the previous socket's
+        # queued writes are in; after that state lives in memory
+        snap = await writer.call(_load_snapshot, session_id)
+
         # ---------- first message ----------
-        init_state  = ConversationState.start
-        init_reply  = await ai_client.generate_response(init_state.value, engine.get_prompt(init_state))
-        await safe_send({"type": "bot_message", "content": init_reply, "data": {"state": init_state.value}})
-        await crud.save_message(db, user.id, "assistant", init_reply)
-        await crud.update_session_state(db, user.id, ConversationState.collecting_zip.value)
+        if snap.is_new:
+            init_state = ConversationState.start
+            greeting   = greetings.pick()
+            seq        = snap.next_seq()
+            if greeting is not None:
+                await _send_text(safe_send, init_state, greeting, stream, seq=seq)
+            else:
+                greeting = await _send_reply(safe_send, init_state, stream=stream, seq=seq)
+            uow = crud.UnitOfWork(snap.user_id, lease=lease, events=events)
+            uow.save_message("assistant", greeting, seq=seq)
+            snap.last_reply = greeting
+            snap.set_state(engine.get_next_state(init_state, None, snap.state_data))
+            snap.drain_into(uow)
+            writer.submit(_commit_turn, uow, snap, init_state.value)
+        else:
+            resumed = snap.current_state
+            # ids this session already stored, whichever connection sent them: a resend is only re-acknowledged
+            for row in reversed(await writer.call(_client_ids, snap.user_id)):
+                remember(row.client_id, row.seq)
+            if last_seq is not None and last_seq <= snap.last_seq:
+                # delta sync: only what the client hasn't got, its own unacknowledged messages included
+                for row in await writer.call(_messages_since, snap.user_id, last_seq):
+                    await safe_send({
+                        "type": "message_replay",
+                        "content": row.content,
+                        "data": {"role": row.role, "seq": row.seq, "id": row.client_id},
+                    })
+                    if row.client_id:
+                        remember(row.client_id, row.seq)
+                if snap.last_reply is None:
+                    # the reply to the user's last answer never went out: ask the current question
+                    await safe_send({
+                        "type": "bot_message",
+                        "content": engine.get_prompt(resumed),
+                        "data": {"state": resumed.value, "resumed": True, "last_seq": snap.last_seq},
+                    })
+            else:
+                # reconnect without a usable last_seq: repeat the open question as it was worded.
+                # One above what was saved (turns that never committed, or a bogus value) is ignored:
+                # numbering only follows what the server has handed out
+                await safe_send({
+                    "type": "bot_message",
+                    "content": snap.last_reply or engine.get_prompt(resumed),
+                    "data": {"state": resumed.value, "resumed": True, "last_seq": snap.last_seq},
+                })
+            await safe_send(STATE_UPDATE_FRAMES[resumed])
+        speculator.start(engine.candidate_next_states(snap.current_state, snap.state_data), snap.full_name)
+
+        # ---------- socket reader ----------
+        # frames are read independently of turn processing, so a burst of
+        # input is merged or shed here instead of piling up behind the LLM
+        async def read_frames():
+            nonlocal upload
+            try:
+                while True:
+                    frame = await ws.receive()
+                    if frame["type"] == "websocket.disconnect":
+                        return
+
+                    # binary frames are chunks of the current voice upload
+                    if frame.get("bytes") is not None:
+                        if upload is not None and not upload.rejected and not upload.write(frame["bytes"]):
+                            await safe_send({"type": "error", "content": "Voice message too large."})
+                        continue
+
+                    try:
+                        data = codec.loads(frame.get("text") or "")
+                    except ValueError:
+                        continue
+
+                    kind = data.get("type")
+                    if kind == "user_audio_start":
+                        if upload is not None:
+                            upload.close()
+                        upload = AudioUpload((data.get("data") or {}).get("format"), AUDIO_MAX_BYTES, AUDIO_SPOOL_BYTES)
+                        continue
+                    elif kind == "user_audio_end":
+                        if upload is None:
+                            continue
+                        done, upload = upload, None
+                        result = "queued" if inbound.put("audio", done) else "shed"
+                        if result == "shed":
+                            done.close()
+                    elif kind == "user_audio":
+                        # legacy single-frame base64 upload
+                        b64 = data.get("content", "")
+                        if len(b64) * 3 // 4 > AUDIO_MAX_BYTES:
+                            await safe_send({"type": "error", "content": "Voice message too large."})
+                            continue
+                        try:
+                            audio_bytes = base64.b64decode(b64)
+                        except Exception:
+                            continue
+                        result = "queued" if inbound.put("audio_bytes", audio_bytes) else "shed"
+                    elif kind == "user_message":
+                        text = data.get("content", "").strip()
+                        if not text:
+                            continue
+                        client_id = str(data.get("id") or "")[:64] or None
+                        if client_id in seen:
+                            # a resend after a reconnect: already queued or saved, never run twice
+                            if seen[client_id] is not None:
+                                await safe_send({"type": "ack", "data": {"id": client_id, "seq": seen[client_id],
+                                                                         "duplicate": True}})
+                            continue
+                        result = inbound.put_text(text, client_id)
+                        if client_id and result != "shed":
+                            remember(client_id, None)
+                    else:
+                        continue
+
+                    INBOUND.inc(result=result)
+                    if result == "shed":
+                        await safe_send({
+                            "type": "message_dropped",
+                            "content": "You're sending messages faster than I can answer. Please send that again in a moment.",
+                            "data": {"reason": "queue_full", "id": data.get("id")},
+                        })
+            except WebSocketDisconnect:
+                pass
+            finally:
+                inbound.close()
+
+        reader = asyncio.create_task(read_frames())
 
         # ---------- main loop ----------
         while True:
-            data = await ws.receive_json()
+            item = await inbound.get()
+            if item is None or taken_over.is_set():
+                raise WebSocketDisconnect()
+            kind, payload = item
+
+            # a new turn makes the previous reply's audio moot
+            if speech is not None:
+                speech.cancel()
+                speech = None
 
-            # Determine user text from either audio or message
-            if data.get("type") == "user_audio":
-                b64 = data.get("content", "")
+            if kind == "text":
+                said     = payload
+                user_msg = "\n".join(text for text, _ in payload)  # one line per message; the flow reads them as separate answers
+            elif kind == "audio":
                 try:
-                    audio_bytes = base64.b64decode(b64)
-                except Exception:
-                    continue
-                user_msg = await ai_client.transcribe_audio(audio_bytes)
-            elif data.get("type") == "user_message":
-                user_msg = data.get("content", "").strip()
+                    audio = payload.finish()
+                    user_msg = await ai_client.transcribe_audio(audio, filename=payload.filename) if audio else ""
+                finally:
+                    payload.close()
+                said = [(user_msg, None)]
             else:
-                continue
+                user_msg = await ai_client.transcribe_audio(payload)
+                said = [(user_msg, None)]
 
             if not user_msg:
                 continue
 
-            await crud.save_message(db, user.id, "user", user_msg)
-
-            session     = await crud.get_session(db, user.id)
-            current     = ConversationState(session.current_state)
-            state_data  = json.loads(session.state_data)
-
-            ok, parsed, err = engine.validate_input(current, user_msg)
+            if snap.stale:
+                stale, snap = snap, await writer.call(_load_snapshot, session_id)
+                snap.last_seq = max(snap.last_seq, stale.last_seq)  # numbers the client has seen stay used
+            current     = snap.current_state
+            state_data  = snap.state_data
+            turn_started = time.perf_counter()
+
+            # the whole turn is written in one background transaction
+            uow = crud.UnitOfWork(snap.user_id, lease=lease, events=events)
+            for text, client_id in said:
+                seq = snap.next_seq()
+                uow.save_message("user", text, seq=seq, client_id=client_id)
+                if client_id:
+                    remember(client_id, seq)
+                    await safe_send({"type": "ack", "data": {"id": client_id, "seq": seq}})
+
+            with TURN_STAGE_SECONDS.time(stage="validate", state=current.value):
+                ok, parsed, err = engine.check_answers(current, user_msg)
             if not ok:
-                err_txt = await ai_client.generate_error_response(current.value, user_msg, err)
-                await safe_send({"type": "bot_message", "content": err_txt})
-                await crud.save_message(db, user.id, "assistant", err_txt)
+                try:
+                    with TURN_STAGE_SECONDS.time(stage="clarify", state=current.value):
+                        err_txt = await inbound.race(replies.clarify(current, user_msg, err))
+                        seq = snap.next_seq()
+                        await safe_send({"type": "bot_message", "content": err_txt, "data": {"seq": seq}})
+                except Superseded:
+                    # the next message answers for itself
+                    INBOUND.inc(result="superseded")
+                    writer.submit(_commit_turn, uow, snap, current.value)
+                    continue
+                uow.save_message("assistant", err_txt, seq=seq)
+                snap.last_reply = err_txt
+                writer.submit(_commit_turn, uow, snap, current.value)
+                TURN_STAGE_SECONDS.observe(time.perf_counter() - turn_started, stage="turn", state=current.value)
                 continue
 
-            await _apply_valid_input(db, user, current, parsed, state_data)
-            next_state = engine.get_next_state(current, parsed, state_data)
-
-            # ─── SIMPLE FULL‐CALL RESPONSE ────────────────────────────────
-            reply = await ai_client.generate_response(
-                next_state.value,
-                engine.get_prompt(next_state),
-                user_name=user.full_name,
-            )
+            # "94103, Jane Doe, jane@x.com" answers three questions with one reply
+            next_state, filled = engine.apply_answers(current, user_msg, snap, uow)
+            FIELDS_PER_TURN.observe(filled)
+            snap.set_state(next_state)
+            snap.drain_into(uow)
 
-            # update DB
-            await crud.update_session_state(db, user.id, next_state.value, state_data)
-            await crud.save_message(db, user.id, "assistant", reply)
+            # send text reply (streamed or full-call) and progress together
+            seq = snap.next_seq()
+            try:
+                with TURN_STAGE_SECONDS.time(stage="reply", state=next_state.value):
+                    reply = await inbound.race(_send_reply(
+                        safe_send, next_state,
+                        user_name=snap.full_name,
+                        stream=stream,
+                        pending=speculator.take(next_state, snap.full_name),
+                        seq=seq,
+                    ))
+            except Superseded:
+                # the answers still count; only the question about what comes next is dropped
+                INBOUND.inc(result="superseded")
+                snap.last_reply = None  # asked about the previous state; a resume asks the new one
+                writer.submit(_commit_turn, uow, snap, current.value)
+                continue
+            await safe_send(STATE_UPDATE_FRAMES[next_state])
+            uow.save_message("assistant", reply, seq=seq)
+            snap.last_reply = reply
+            writer.submit(_commit_turn, uow, snap, current.value)
+            TURN_STAGE_SECONDS.observe(time.perf_counter() - turn_started, stage="turn", state=current.value)
 
-            # send text reply
-            await safe_send({
-                "type": "bot_message",
-                "content": reply,
-                "data": {"state": next_state.value}
-            })
+            # start on the next answer's reply while this one is being read
+            speculator.start(engine.candidate_next_states(next_state, state_data), snap.full_name)
 
-            # synthesize and send audio reply
-            try:
-                mp3_bytes = await ai_client.synth_speech(reply)
-                mp3_b64 = base64.b64encode(mp3_bytes).decode()
-                await safe_send({"type": "bot_audio", "content": mp3_b64})
-            except Exception as e:
-                logger.warning("Failed to synthesize speech: %s", e)
-
-            # progress update
-            await safe_send({
-                "type": "state_update",
-                "data": {
-                    "current_state": next_state.value,
-                    "progress": engine.calculate_progress(next_state),
-                },
-            })
+            # audio goes out as a binary frame whenever it is ready
+            if tts:
+                speech = background.spawn(_send_speech(safe_send, reply, next_state.value))
 
     except WebSocketDisconnect:
         logger.info("client disconnected: %s", session_id)
@@ -147,55 +440,256 @@ async def websocket_endpoint(ws: WebSocket, db: AsyncSession = Depends(get_sessi
             await ws.close()
         except Exception:
             pass
+    finally:
+        OPEN_SOCKETS.dec()
+        speculator.discard()
+        if reader is not None:
+            reader.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
+        if upload is not None:
+            upload.close()
+        for kind, payload in inbound.drain():
+            if kind == "audio":
+                payload.close()
+        await background.cancel_all()
+        await writer.close()
+        if connections.get(session_id, (None, None))[0] is writer:
+            del connections[session_id]
+
+
+# ------------------------------------------------------------------ #
+#  Live transcript for agents
+# ------------------------------------------------------------------ #
+@app.websocket("/ws/observe")
+async def observe_endpoint(ws: WebSocket):
+    """Committed messages and state changes of one session (``?session=``) or of all of them, as JSON text frames."""
+    token = ws.query_params.get("token") or ""
+    if not OBSERVE_TOKEN or not hmac.compare_digest(token.encode(), OBSERVE_TOKEN.encode()):
+        await ws.close(code=4401)
+        return
+    await ws.accept()
+    sub = broadcaster.subscribe(ws.query_params.get("session") or None)
+
+    async def watch_disconnect():
+        # observers don't talk; this only notices when they leave
+        try:
+            while (await ws.receive())["type"] != "websocket.disconnect":
+                pass
+        finally:
+            sub.close()
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        while True:
+            payload = await sub.get()
+            if payload is None:
+                break
+            await ws.send_text(payload)
+        if sub.dropped:
+            await ws.send_json({"type": "dropped", "content": "Too far behind; reconnect to resume."})
+            await ws.close(code=4408)
+    except (WebSocketDisconnect, ConnectionClosedError, RuntimeError):
+        pass
+    finally:
+        broadcaster.unsubscribe(sub)
+        watcher.cancel()
 
 
 # ------------------------------------------------------------------ #
 #  Helpers
 # ------------------------------------------------------------------ #
-async def _apply_valid_input(
-    db: AsyncSession,
-    user,
+async def _send_reply(
+    send,
     state: ConversationState,
-    parsed,
-    state_data: dict,
-):
-    """Write validated data to DB / session_state."""
-    if state == ConversationState.collecting_zip:
-        await crud.update_user(db, user.id, zip_code=parsed)
+    user_name: Optional[str] = None,
+    stream: bool = False,
+    pending: Optional[asyncio.Task] = None,
+    seq: Optional[int] = None,
+) -> str:
+    """Generate the reply for *state*, send it and return the assembled text.
+
+    Streaming sends one ``bot_message_delta`` per chunk followed by a
+    ``bot_message_done`` carrying the full text; otherwise a single
+    ``bot_message`` is sent.  A *pending* speculative reply is sent whole.
+    *seq* is the message's sequence number, sent along in ``data``.
+    """
+    base_prompt = engine.get_prompt(state)
+    if not stream or pending is not None:
+        reply = await replies.reply(state, base_prompt, user_name=user_name, pending=pending)
+        await _send_text(send, state, reply, stream, seq=seq)
+        return reply
+    data = {"state": state.value, "seq": seq}
+
+    parts = []
+    try:
+        async for delta in replies.stream(state, base_prompt, user_name=user_name):
+            parts.append(delta)
+            await send({"type": "bot_message_delta", "content": delta, "data": data})
+    except asyncio.CancelledError:
+        # superseded mid-stream: close the bubble the client already opened
+        if parts:
+            await send({"type": "bot_message_done", "content": "".join(parts).strip(),
+                        "data": {**data, "superseded": True}})
+        raise
+
+    reply = "".join(parts).strip() or base_prompt
+    await send({"type": "bot_message_done", "content": reply, "data": data})
+    return reply
+
+
+async def _send_text(
+    send, state: ConversationState, text: str, stream: bool = False, seq: Optional[int] = None
+) -> None:
+    """Send ready-made *text* in the connection's framing (whole, even when streaming)."""
+    data = {"state": state.value, "seq": seq}
+    if stream:
+        await send({"type": "bot_message_delta", "content": text, "data": data})
+        await send({"type": "bot_message_done", "content": text, "data": data})
+    else:
+        await send({"type": "bot_message", "content": text, "data": data})
+
+
+async def _send_speech(send, text: str, state: str = "") -> None:
+    try:
+        with TURN_STAGE_SECONDS.time(stage="tts", state=state):
+            mp3_bytes = await ai_client.synth_speech(text)
+        if mp3_bytes:
+            await send(mp3_bytes)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.warning("Failed to synthesize speech: %s", e)
+
+
+async def _load_snapshot(session_id: str) -> SessionSnapshot:
+    async with session_scope() as db:
+        return await load_snapshot(db, session_id)
 
-    elif state == ConversationState.collecting_name:
-        await crud.update_user(db, user.id, full_name=parsed)
 
-    elif state == ConversationState.collecting_email:
-        await crud.update_user(db, user.id, email=parsed)
+async def _messages_since(user_id: int, after_seq: int):
+    async with session_scope() as db:
+        return await crud.get_messages_since(db, user_id, after_seq)
 
-    elif state == ConversationState.collecting_vehicle_info:
-        state_data["current_vehicle"] = parsed
 
-    elif state == ConversationState.collecting_vehicle_use:
-        state_data["current_vehicle"]["vehicle_use"] = parsed
+async def _client_ids(user_id: int):
+    async with session_scope() as db:
+        return await crud.get_client_ids(db, user_id, limit=SEEN_IDS_MAX)
+
+
+async def _commit_turn(uow: crud.UnitOfWork, snap: SessionSnapshot, state: str = "") -> None:
+    try:
+        with TURN_STAGE_SECONDS.time(stage="persist", state=state):
+            if group_committer is not None:
+                await group_committer.commit(uow)
+            else:
+                async with session_scope() as db:
+                    await uow.flush(db)
+    except crud.LeaseLost:
+        # a newer connection owns the session; its state is the one that counts
+        uow.lease.lost.set()
+        logger.info("dropped a turn for %s: session taken over", snap.session_id)
+    except Exception:
+        # memory is ahead of Postgres now; force a re-read next turn
+        snap.stale = True
+        raise
 
-    elif state == ConversationState.collecting_blind_spot:
-        state_data["current_vehicle"]["blind_spot_warning"] = parsed
 
-    elif state == ConversationState.collecting_commute_days:
-        state_data["current_vehicle"]["days_per_week"] = parsed
+# ------------------------------------------------------------------ #
+#  Transcript API
+# ------------------------------------------------------------------ #
+@app.get("/api/sessions/{session_id}/messages", response_model=MessagePage)
+async def list_messages(
+    session_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    since: Optional[str] = None,
+    db: AsyncSession = Depends(get_session),
+):
+    """Newest page by default; ``cursor`` pages back in time, ``since`` returns only newer messages."""
+    try:
+        before = _decode_cursor(cursor) if cursor else None
+        after  = _decode_cursor(since) if since else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    rows = await crud.get_messages_page(db, session_id, limit=limit, before=before, after=after)
+    if rows is None:
+        raise HTTPException(status_code=404, detail="Unknown session")
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if after is None:
+        rows.reverse()  # fetched newest-first
+    messages = [MessageOut(id=r.id, role=r.role, content=r.content, timestamp=r.timestamp, seq=r.seq) for r in rows]
+
+    return MessagePage(
+        messages=messages,
+        next_cursor=_encode_cursor(rows[0]) if has_more and after is None else None,
+        latest_cursor=_encode_cursor(rows[-1]) if rows else since,
+    )
+
+
+def require_admin(authorization: Optional[str] = Header(None)) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN is not set)")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token", headers={"WWW-Authenticate": "Bearer"})
+
+
+@app.get("/api/exports/onboardings", dependencies=[Depends(require_admin)])
+async def export_onboardings(
+    format: str = Query("ndjson", pattern="^(ndjson|csv|parquet)$"),
+    since: Optional[datetime] = None,
+    batch_size: int = Query(1000, ge=1, le=50_000),
+):
+    """Stream every completed onboarding (optionally only those updated after ``since``)."""
+    if not export.format_available(format):
+        raise HTTPException(status_code=400, detail=f"{format} export is not available on this server (needs pyarrow)")
+    return StreamingResponse(
+        export.export_completed(db_engine, format, since=since, batch_size=batch_size),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="onboardings.{format}"'},
+    )
+
+
+class _UploadStreamingResponse(StreamingResponse):
+    """
+    A ``StreamingResponse`` that doesn't watch for disconnects: that watch
+    reads ``receive`` and would swallow the request body still being
+    streamed in.  A client that goes away ends ``request.stream()`` instead.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+
+
+@app.post("/api/leads/ingest", dependencies=[Depends(require_admin)])
+async def ingest_leads(
+    request: Request,
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    batch_size: int = Query(500, ge=1, le=5000),
+    errors_only: bool = False,
+):
+    """Validate and insert a streamed CSV/NDJSON lead file; responds with an NDJSON per-row report."""
+    return _UploadStreamingResponse(
+        ingest.ingest_stream(db_engine, request.stream(), format, batch_size=batch_size, errors_only=errors_only),
+        media_type="application/x-ndjson",
+    )
 
-    elif state == ConversationState.collecting_commute_miles:
-        state_data["current_vehicle"]["one_way_miles"] = parsed
-        await crud.save_vehicle(db, user.id, state_data["current_vehicle"])
-        state_data["current_vehicle"] = {}
 
-    elif state == ConversationState.collecting_annual_mileage:
-        state_data["current_vehicle"]["annual_mileage"] = parsed
-        await crud.save_vehicle(db, user.id, state_data["current_vehicle"])
-        state_data["current_vehicle"] = {}
+def _encode_cursor(row) -> str:
+    raw = f"{row.timestamp.isoformat()}|{row.id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
 
-    elif state == ConversationState.collecting_license_type:
-        await crud.update_user(db, user.id, license_type=models.LicenseType(parsed))
 
-    elif state == ConversationState.collecting_license_status:
-        await crud.update_user(db, user.id, license_status=models.LicenseStatus(parsed))
+def _decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, msg_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(ts), int(msg_id)
+    except Exception as exc:
+        raise ValueError(cursor) from exc
 
 
 # ------------------------------------------------------------------ #
@@ -203,3 +697,16 @@ async def _apply_valid_input(
 @app.get("/api/health")
 async def health_check():
     return {"status": "healthy", "service": "Bind IQ Chatbot"}
+
+
+@app.get("/api/health/db")
+async def db_health():
+    return pool_stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus text exposition of latency histograms and gauges."""
+    if not metrics.ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,202 @@
+# backend/metrics.py
+"""
+Minimal Prometheus-style metrics for the hot path.
+
+Counters, gauges and histograms are plain dicts keyed by label values, so an
+observation is a dict lookup and an add; nothing is formatted until
+``/metrics`` is scraped.  ``METRICS_ENABLED=0`` turns every call into a
+no-op and ``TRACE_SPANS=1`` additionally logs each timed span.
+"""
+import os
+import time
+import logging
+import functools
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+ENABLED     = os.getenv("METRICS_ENABLED", "1") == "1"
+TRACE_SPANS = os.getenv("TRACE_SPANS", "0") == "1"
+
+trace_logger = logging.getLogger("backend.trace")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry: List["_Metric"] = []
+
+
+def _fmt_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()) -> None:
+        self.name   = name
+        self.doc    = doc
+        self.labels = tuple(labels)
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        if ENABLED:
+            key = self._key(labels)
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        return super().render() + [
+            f"{self.name}{_fmt_labels(self.labels, k)} {v}" for k, v in self._values.items()
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._callback = callback  # sampled at scrape time instead of tracked
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        if ENABLED:
+            key = self._key(labels)
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        if ENABLED:
+            self._values[self._key(labels)] = value
+
+    def render(self) -> List[str]:
+        values = self._callback() if self._callback else self._values
+        return super().render() + [
+            f"{self.name}{_fmt_labels(self.labels, k)} {v}" for k, v in values.items()
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = LATENCY_BUCKETS, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # bucket counts..., +Inf, sum, count
+
+    def observe(self, value: float, **labels) -> None:
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0.0] * (len(self.buckets) + 3)
+        series[bisect_left(self.buckets, value)] += 1  # per-bucket; made cumulative on render
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe(elapsed, **labels)
+            if TRACE_SPANS:
+                trace_logger.info("span %s %s %.2fms", self.name,
+                                  " ".join(f"{k}={v}" for k, v in labels.items()), elapsed * 1000)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, series in self._series.items():
+            running = 0.0
+            for bound, count in zip(self.buckets, series):
+                running += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, le)} {running}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, le)} {series[-1]}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+
+def timed(histogram: Histogram, **labels):
+    """Decorator: observe an async function's duration on *histogram*."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        async def inner(*args, **kwargs):
+            with histogram.time(**labels):
+                return await fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ------------------------------------------------------------------ #
+#  Application metrics
+# ------------------------------------------------------------------ #
+TURN_STAGE_SECONDS = Histogram(
+    "bindiq_turn_stage_seconds", "Time spent in each stage of a WebSocket turn.", ("stage", "state"),
+)
+LLM_SECONDS = Histogram(
+    "bindiq_llm_call_seconds", "Upstream OpenAI call latency.", ("kind", "state"),
+)
+DB_SECONDS = Histogram(
+    "bindiq_db_op_seconds", "Latency of crud operations.", ("op",),
+)
+OPEN_SOCKETS = Gauge("bindiq_open_websockets", "Currently connected chat WebSockets.")
+LLM_INFLIGHT = Gauge("bindiq_llm_inflight_calls", "OpenAI requests currently awaiting a response.")
+LLM_FALLBACKS = Counter(
+    "bindiq_llm_fallbacks_total", "Replies that fell back to static text after an upstream failure.", ("kind",),
+)
+LLM_CACHE = Counter("bindiq_llm_cache_total", "Response cache lookups.", ("result",))
+LLM_QUEUE_DEPTH = Gauge("bindiq_llm_queue_depth", "Calls waiting for an upstream concurrency slot or rate token.")
+LLM_BREAKER_STATE = Gauge("bindiq_llm_circuit_state", "Upstream circuit breaker: 0 closed, 1 half-open, 2 open.")
+LLM_REJECTED = Counter(
+    "bindiq_llm_rejected_total", "Upstream calls not attempted (open circuit or queue deadline).", ("reason",),
+)
+LLM_RETRIES = Counter("bindiq_llm_retries_total", "Upstream calls retried after a transient failure.")
+REPLY_SOURCE = Counter(
+    "bindiq_reply_source_total", "Hybrid replies by where the wording came from (llm, or template after the deadline).",
+    ("source",),
+)
+SPECULATION = Counter(
+    "bindiq_speculation_total", "Speculative replies: hit, miss, wasted (cancelled) or over_budget.", ("result",),
+)
+FIELDS_PER_TURN = Histogram(
+    "bindiq_fields_per_turn", "Answers taken from one valid user message (more than one skips states).",
+    buckets=(1, 2, 3, 4, 6),
+)
+INBOUND = Counter(
+    "bindiq_inbound_messages_total",
+    "User input per connection: queued, coalesced into a queued turn, shed (queue full) or superseded mid-reply.",
+    ("result",),
+)
+OBSERVERS = Gauge("bindiq_observers", "Connected transcript observers (agent dashboards) on this worker.")
+BROADCAST_DROPPED = Counter("bindiq_broadcast_dropped_total", "Observers disconnected for falling behind.")
+ARCHIVED_MESSAGES = Counter("bindiq_archived_messages_total", "Messages moved from the hot table into session archives.")
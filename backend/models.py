@@ -1,5 +1,7 @@
 from sqlmodel import SQLModel, Field, Relationship
-from typing import Optional, List
+from sqlalchemy import JSON, Column, Index, LargeBinary
+from sqlalchemy.dialects.postgresql import JSONB
+from typing import Any, Dict, Optional, List
 from datetime import datetime
 from enum import Enum
 
@@ -47,13 +49,23 @@ class User(SQLModel, table=True):
 
 class ChatMessage(SQLModel, table=True):
     __tablename__ = "messages"
-    __table_args__ = {"extend_existing": True}
+    # (user_id, timestamp, id) serves both per-user lookups and keyset pagination;
+    # (user_id, seq) serves delta sync on reconnect and keeps seq unique per session;
+    # (user_id, client_id) keeps a resent message from being stored twice
+    __table_args__ = (
+        Index("ix_messages_user_ts_id", "user_id", "timestamp", "id"),
+        Index("ux_messages_user_seq", "user_id", "seq", unique=True),
+        Index("ux_messages_user_client_id", "user_id", "client_id", unique=True),
+        {"extend_existing": True},
+    )
 
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int    = Field(foreign_key="users.id", index=True)
+    user_id: int    = Field(foreign_key="users.id")
     role: str       = Field(nullable=False)  # 'user' or 'assistant'
     content: str    = Field(nullable=False)
     timestamp: datetime = Field(default_factory=datetime.utcnow)
+    seq: Optional[int]  = None  # per-session order, 1, 2, 3, ... (gaps allowed)
+    client_id: Optional[str] = None  # the client's id for a user message, for resend dedup
 
     user: Optional[User] = Relationship(back_populates="messages")
 
@@ -84,10 +96,36 @@ class Session(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int      = Field(foreign_key="users.id", unique=True, index=True)
     current_state: str
-    state_data: str = "{}"
+    # JSONB on Postgres (patched in place, queryable), JSON text elsewhere
+    state_data: Dict[str, Any] = Field(
+        default_factory=dict, sa_column=Column(JSON().with_variant(JSONB(), "postgresql"), nullable=False)
+    )
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
     user: Optional[User] = Relationship(
         back_populates="session", sa_relationship_kwargs={"uselist": False}
     )
+
+class SessionLease(SQLModel, table=True):
+    """Which connection owns a chat session; ``token`` goes up with every takeover."""
+    __tablename__ = "session_leases"
+    __table_args__ = {"extend_existing": True}
+
+    session_id: str = Field(primary_key=True)
+    owner: str      = Field(nullable=False)  # "<host>:<pid>/<connection>"
+    token: int      = Field(default=1, nullable=False)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)  # last takeover
+
+class MessageArchive(SQLModel, table=True):
+    """A finished session's transcript, moved out of ``messages`` into one compressed blob."""
+    __tablename__ = "message_archives"
+    __table_args__ = {"extend_existing": True}
+
+    user_id: int = Field(foreign_key="users.id", primary_key=True)
+    message_count: int = Field(nullable=False)
+    first_at: datetime = Field(nullable=False)
+    last_at: datetime  = Field(nullable=False)
+    last_seq: Optional[int] = None
+    data: bytes = Field(sa_column=Column(LargeBinary, nullable=False))  # zlib-compressed JSON rows
+    archived_at: datetime = Field(default_factory=datetime.utcnow)
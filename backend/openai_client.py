@@ -1,13 +1,114 @@
 # backend/openai_client.py
 from openai import AsyncOpenAI
+from collections import OrderedDict
 import os
 import io
+import time
+import random
+import asyncio
 import base64
 import logging
-from typing import AsyncGenerator, Optional, Union, List, Dict
+import tempfile
+from typing import AsyncGenerator, Awaitable, BinaryIO, Callable, Optional, Union, List, Dict
+
+from backend.tts_cache import AudioCache
+from backend.metrics import LLM_SECONDS, LLM_INFLIGHT, LLM_FALLBACKS, LLM_CACHE
+from backend.resilience import RETRYABLE, CircuitBreaker, UpstreamGuard
 
 logger = logging.getLogger(__name__)
 
+# placeholder the LLM writes where the user's name belongs, so one cached
+# rephrasing can be reused for every named user
+NAME_TOKEN = "[NAME]"
+
+
+class ResponseCache:
+    """
+    LRU/TTL cache of interchangeable LLM replies.
+
+    Every key holds a pool of up to ``variants`` rephrasings; once a key has
+    at least one, reads are served from memory and the pool is topped up in the
+    background.  Concurrent misses on the same key share one upstream call.
+    """
+
+    def __init__(self, max_keys: int = 1024, ttl: float = 3600.0, variants: int = 3) -> None:
+        self.max_keys = max_keys
+        self.ttl      = ttl
+        self.variants = variants
+        self._pools: "OrderedDict[str, tuple[float, List[str]]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Whitespace/case-normalised key so trivially different prompts collide."""
+        return "\x1f".join(" ".join(str(p).split()).lower() for p in parts)
+
+    # ------------------------------------------------------------------ #
+    def get(self, key: str, refill: Optional[Callable[[], Awaitable[str]]] = None) -> Optional[str]:
+        """Return a random pooled reply (or None); schedule *refill* if the pool is short."""
+        item = self._pools.get(key)
+        if item is None:
+            LLM_CACHE.inc(result="miss")
+            return None
+        created, pool = item
+        if time.monotonic() - created > self.ttl:
+            del self._pools[key]
+            LLM_CACHE.inc(result="expired")
+            return None
+        LLM_CACHE.inc(result="hit")
+        self._pools.move_to_end(key)
+        if refill is not None and len(pool) < self.variants and key not in self._inflight:
+            fut = self._start(key, refill)
+            fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return random.choice(pool)
+
+    def add(self, key: str, text: str) -> None:
+        created, pool = self._pools.get(key, (time.monotonic(), []))
+        if text not in pool:
+            pool = (pool + [text])[-self.variants:]
+        self._pools[key] = (created, pool)
+        self._pools.move_to_end(key)
+        while len(self._pools) > self.max_keys:
+            self._pools.popitem(last=False)
+
+    def pending(self, key: str) -> Optional[asyncio.Future]:
+        return self._inflight.get(key)
+
+    def claim(self, key: str) -> asyncio.Future:
+        """Register the caller as the single producer for *key*; finish with ``resolve``."""
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        return fut
+
+    def resolve(self, key: str, fut: asyncio.Future, text: Optional[str]) -> None:
+        if self._inflight.get(key) is fut:
+            del self._inflight[key]
+        if text:
+            self.add(key, text)
+        if not fut.done():
+            fut.set_result(text)
+
+    async def get_or_fill(self, key: str, fill: Callable[[], Awaitable[str]]) -> str:
+        """Cached reply for *key*, calling *fill* at most once across concurrent callers."""
+        hit = self.get(key, refill=fill)
+        if hit is not None:
+            return hit
+        fut = self._inflight.get(key) or self._start(key, fill)
+        # shield: one waiter being cancelled must not cancel everyone's call
+        return await asyncio.shield(fut)
+
+    def _start(self, key: str, fill: Callable[[], Awaitable[str]]) -> asyncio.Future:
+        async def _run() -> str:
+            text = await fill()
+            if text:
+                self.add(key, text)
+            return text
+
+        fut = asyncio.ensure_future(_run())
+        self._inflight[key] = fut
+        fut.add_done_callback(lambda f: self._inflight.pop(key, None) if self._inflight.get(key) is f else None)
+        return fut
+
 
 class OpenAIClient:
 
@@ -15,20 +116,81 @@ class OpenAIClient:
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise RuntimeError("OPENAI_API_KEY env-var missing")
-        self.client = AsyncOpenAI(api_key=api_key)
+        # retries and deadlines are handled by self.guard, not the SDK
+        timeout = float(os.getenv("LLM_TIMEOUT", "10"))
+        self.client = AsyncOpenAI(api_key=api_key, max_retries=0, timeout=timeout)
+        self.guard = UpstreamGuard(
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "32")),
+            rate=float(os.getenv("LLM_RATE_PER_SEC", "0")),
+            burst=float(os.getenv("LLM_RATE_BURST", "0")) or None,
+            timeout=timeout,
+            retries=int(os.getenv("LLM_RETRIES", "2")),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+                reset_after=float(os.getenv("LLM_BREAKER_RESET", "30")),
+            ),
+        )
+        # longest gap tolerated between streamed chunks
+        self.stream_idle_timeout = float(os.getenv("LLM_STREAM_IDLE_TIMEOUT", "5"))
 
         # let env override, otherwise use the speedy/cheap model
         self.model = os.getenv("OPENAI_MODEL", "gpt-4.1-nano")
 
+        self.cache: Optional[ResponseCache] = None
+        if os.getenv("LLM_CACHE_ENABLED", "1") == "1":
+            self.cache = ResponseCache(
+                max_keys=int(os.getenv("LLM_CACHE_MAX_KEYS", "1024")),
+                ttl=float(os.getenv("LLM_CACHE_TTL", "3600")),
+                variants=int(os.getenv("LLM_CACHE_VARIANTS", "3")),
+            )
+
+        self.tts_model = os.getenv("TTS_MODEL", "tts-1")
+        self.tts_voice = os.getenv("TTS_VOICE", "alloy")
+        self.tts_cache: Optional[AudioCache] = None
+        if os.getenv("TTS_CACHE_ENABLED", "1") == "1":
+            self.tts_cache = AudioCache(
+                os.getenv("TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "bindiq-tts")),
+                max_bytes=int(float(os.getenv("TTS_CACHE_MAX_MB", "256")) * 1024 * 1024),
+            )
+
     # ------------------------------------------------------------------ #
-    async def _chat(self, messages: List[Dict[str, str]], *, stream: bool):
-        return await self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            temperature=0.7,
-            max_tokens=150,
-            stream=stream,
-        )
+    async def _create(self, messages: List[Dict[str, str]], *, stream: bool):
+        LLM_INFLIGHT.inc()
+        try:
+            return await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=150,
+                stream=stream,
+            )
+        finally:
+            LLM_INFLIGHT.dec()
+
+    async def _chat(self, messages: List[Dict[str, str]]):
+        """One completion through the admission guard (slot, deadline, retries, breaker)."""
+        deadline = self.guard.deadline()
+        async with self.guard.slot(deadline):
+            return await self.guard.call(lambda: self._create(messages, stream=False), deadline)
+
+    async def _chat_stream(self, messages: List[Dict[str, str]]) -> AsyncGenerator[str, None]:
+        """Streamed completion text; the upstream slot is held until the stream ends."""
+        deadline = self.guard.deadline()
+        async with self.guard.slot(deadline):
+            stream = await self.guard.call(lambda: self._create(messages, stream=True), deadline)
+            chunks = stream.__aiter__()
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), self.stream_idle_timeout)
+                    except StopAsyncIteration:
+                        return
+                    delta = chunk.choices[0].delta.content or ""
+                    if delta:
+                        yield delta
+            except RETRYABLE:
+                self.guard.breaker.record_failure()
+                raise
 
     # ------------------------------------------------------------------ #
     async def generate_response(
@@ -37,48 +199,101 @@ class OpenAIClient:
         base_prompt: str,
         user_name: Optional[str] = None,
         stream: bool = False,
+        fresh: bool = False,
     ) -> Union[str, AsyncGenerator[str, None]]:
         """
         If stream==False  → returns a str  
         If stream==True   → returns an async generator that yields incremental text
+        fresh=True (non-stream) always calls upstream and adds the result to the cache
         """
 
         system_prompt = (
             "You are a friendly insurance-onboarding assistant. "
             "Keep replies warm, ≤3 short sentences, and ask ONLY for the field in the current step."
         )
+        # with the cache on, the name is templated in afterwards so that the
+        # rephrasing only depends on whether a name is known
+        prompt_name = (NAME_TOKEN if self.cache else user_name) if user_name else "Not provided"
         user_prompt = (
             f"Current state: {state}\n"
             f"Base message: {base_prompt}\n"
-            f"User name: {user_name or 'Not provided'}\n\n"
+            f"User name: {prompt_name}\n\n"
             "Rewrite the base message conversationally. "
             "Use the user's name sparingly (≈ once every few turns)."
         )
+        if self.cache and user_name:
+            user_prompt += f" Write the name exactly as {NAME_TOKEN}."
 
         messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user",   "content": user_prompt},
         ]
+        key = ResponseCache.make_key("reply", state, base_prompt, bool(user_name))
+
+        def _personalise(text: str) -> str:
+            return text.replace(NAME_TOKEN, user_name or "there")
+
+        async def _fill() -> str:
+            with LLM_SECONDS.time(kind="reply", state=state):
+                resp = await self._chat(messages)
+            return resp.choices[0].message.content.strip()
 
         # ---- non-stream ----
         if not stream:
             try:
-                resp = await self._chat(messages, stream=False)
-                return resp.choices[0].message.content.strip()
+                if self.cache and fresh:
+                    text = await _fill()
+                    self.cache.add(key, text)
+                    return _personalise(text)
+                if self.cache:
+                    return _personalise(await self.cache.get_or_fill(key, _fill))
+                return await _fill()
             except Exception as e:
                 logger.error("OpenAI error (non-stream): %s", e)
+                LLM_FALLBACKS.inc(kind="reply")
                 return base_prompt
 
         # ---- streaming branch ----
         async def _gen() -> AsyncGenerator[str, None]:
+            if self.cache:
+                hit = self.cache.get(key, refill=_fill)
+                if hit is None and self.cache.pending(key):
+                    # someone is already generating this prompt: wait for theirs
+                    try:
+                        hit = await asyncio.shield(self.cache.pending(key)) or base_prompt
+                    except Exception:
+                        hit = base_prompt
+                if hit is not None:
+                    yield _personalise(hit)
+                    return
+                lead = self.cache.claim(key)
+
+            parts: List[str] = []
+            complete = False
+            held = ""  # text held back while a NAME_TOKEN may be split across chunks
+            started = time.perf_counter()
             try:
-                async for chunk in (await self._chat(messages, stream=True)):
-                    delta = chunk.choices[0].delta.content or ""
-                    if delta:
-                        yield delta
+                async for delta in self._chat_stream(messages):
+                    parts.append(delta)
+                    held += delta
+                    tail = held[held.rfind("["):] if "[" in held else ""
+                    if tail and "]" not in tail and len(tail) < len(NAME_TOKEN):
+                        continue
+                    yield _personalise(held)
+                    held = ""
+                if held:
+                    yield _personalise(held)
+                complete = True
+                LLM_SECONDS.observe(time.perf_counter() - started, kind="reply_stream", state=state)
             except Exception as e:
                 logger.error("OpenAI error (stream): %s", e)
-                yield "\n*(sorry, I hit an error)*"
+                LLM_FALLBACKS.inc(kind="reply_stream")
+                # nothing streamed yet → fall back like the non-stream branch
+                yield "\n*(sorry, I hit an error)*" if parts else base_prompt
+            finally:
+                # only a fully streamed reply is worth pooling
+                if self.cache:
+                    self.cache.resolve(key, lead, "".join(parts).strip() if complete else None)
 
         return _gen()
 
@@ -91,55 +306,76 @@ class OpenAIClient:
             "You are a helpful insurance assistant. "
             "When users make input errors, gently guide them without sounding condescending."
         )
+        # the user's exact input is left out when caching: the clarification
+        # then only depends on (state, error) and can be shared across sessions
         user_prompt = (
             f"The user provided invalid input for {state}.\n"
-            f'User input: "{user_input}"\n'
-            f"Error: {error_message}\n"
+            + ("" if self.cache else f'User input: "{user_input}"\n')
+            + f"Error: {error_message}\n"
             "Create a friendly 1-2 sentence clarification."
         )
-        try:
-            resp = await self._chat(
-                [{"role": "system", "content": sys_prompt}, {"role": "user", "content": user_prompt}],
-                stream=False,
-            )
+        messages = [{"role": "system", "content": sys_prompt}, {"role": "user", "content": user_prompt}]
+
+        async def _fill() -> str:
+            with LLM_SECONDS.time(kind="error", state=state):
+                resp = await self._chat(messages)
             return resp.choices[0].message.content.strip()
+
+        try:
+            if self.cache:
+                return await self.cache.get_or_fill(ResponseCache.make_key("error", state, error_message), _fill)
+            return await _fill()
         except Exception as e:
             logger.error("OpenAI error (error-resp): %s", e)
+            LLM_FALLBACKS.inc(kind="error")
             return f"I didn't understand that—{error_message}"
 
     # ------------------ speech helpers ------------------ #
-    async def transcribe_audio(self, data: bytes) -> str:
-        """Whisper-based speech-to-text"""
+    async def transcribe_audio(self, data: Union[bytes, BinaryIO], filename: str = "audio.webm") -> str:
+        """Whisper-based speech-to-text; *data* may be raw bytes or an open file"""
         try:
-            buf = io.BytesIO(data)
-            buf.name = "audio.webm"  # adjust if frontend sends other formats
-            resp = await self.client.audio.transcriptions.create(
-                model="whisper-1", file=buf, response_format="text"
-            )
+            buf = io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+            with LLM_SECONDS.time(kind="stt"):
+                resp = await self.client.audio.transcriptions.create(
+                    model="whisper-1", file=(filename, buf), response_format="text"
+                )
             if isinstance(resp, str):
                 return resp.strip()
             # some SDKs return dict-like
             return resp.get("text", "").strip() if isinstance(resp, dict) else ""
         except Exception as e:
             logger.error("STT error: %s", e)
+            LLM_FALLBACKS.inc(kind="stt")
             return ""
 
-    async def synth_speech(self, text: str) -> bytes:
-        """TTS: convert assistant text to audio bytes"""
+    async def synth_speech(self, text: str, voice: Optional[str] = None) -> bytes:
+        """TTS: convert assistant text to audio bytes (served from the disk cache when possible)"""
+        voice = voice or self.tts_voice
+        key = AudioCache.key(text, voice, self.tts_model) if self.tts_cache else None
+        if key:
+            cached = await self.tts_cache.get(key)
+            if cached:
+                return cached
         try:
-            resp = await self.client.audio.speech.create(
-                model="tts-1",
-                voice="alloy",
-                input=text,
-            )
+            with LLM_SECONDS.time(kind="tts"):
+                resp = await self.client.audio.speech.create(
+                    model=self.tts_model,
+                    voice=voice,
+                    input=text,
+                )
             # Depending on SDK shape:
             if hasattr(resp, "read"):
-                return resp.read()
-            if hasattr(resp, "content"):
-                return resp.content
-            if isinstance(resp, str):
-                return base64.b64decode(resp)
-            return b""
+                audio = resp.read()
+            elif hasattr(resp, "content"):
+                audio = resp.content
+            elif isinstance(resp, str):
+                audio = base64.b64decode(resp)
+            else:
+                audio = b""
         except Exception as e:
             logger.error("TTS error: %s", e)
+            LLM_FALLBACKS.inc(kind="tts")
             return b""
+        if key and audio:
+            await self.tts_cache.put(key, audio)
+        return audio
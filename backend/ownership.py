@@ -0,0 +1,46 @@
+# backend/ownership.py
+"""
+One owner per chat session, across worker processes and nodes.
+
+A connection takes a lease on its session id in Postgres.  Taking it
+always succeeds (the newest connection wins) and bumps a fencing
+``token``; every turn's transaction re-checks that token (see
+``crud.UnitOfWork``), so a stale connection can no longer write once a
+newer one exists.  The stale side notices at its next write, or
+immediately when the takeover happens in the same process, and closes
+its socket.  Idle connections cost the database nothing.
+"""
+import os
+import uuid
+import socket
+import asyncio
+import logging
+from typing import Optional
+
+import backend.crud as crud
+from backend.db import session_scope
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("SESSION_LEASES", "1") == "1"
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# WebSocket close code sent to the connection that lost its session
+TAKEN_OVER = 4409
+
+
+class SessionLease:
+    """This connection's claim on a session id; ``lost`` is set once a newer one takes it."""
+
+    def __init__(self, session_id: str) -> None:
+        self.session_id = session_id
+        self.owner      = f"{WORKER_ID}/{uuid.uuid4().hex[:8]}"
+        self.token: Optional[int] = None
+        self.lost       = asyncio.Event()
+
+    async def acquire(self) -> int:
+        async with session_scope() as db:
+            self.token = await crud.acquire_lease(db, self.session_id, self.owner)
+        logger.debug("session %s leased by %s (token %d)", self.session_id, self.owner, self.token)
+        return self.token
@@ -0,0 +1,186 @@
+# backend/partitions.py
+"""
+Monthly range partitions for ``messages`` on Postgres (``MESSAGE_PARTITIONS=1``).
+
+``init_db`` turns the plain table into a partitioned one: the existing
+rows stay where they are as the ``messages_legacy`` partition, covering
+everything up to the month after the newest of them, and new months get
+their own ``messages_pYYYY_MM`` partition, created ``MESSAGE_PARTITIONS_AHEAD``
+months in advance.  A ``messages_default`` partition catches anything
+outside that range so inserts never fail.  Old partitions left empty by
+archiving (see ``backend.archive``) are dropped, which hands their space
+and index pages straight back instead of waiting on vacuum.
+
+Postgres requires unique indexes on a partitioned table to include the
+partition key, so ``ux_messages_user_seq`` and ``ux_messages_user_client_id``
+get ``timestamp`` appended there; seq and client ids stay unique in
+practice because one leased connection writes a session's messages and
+checks the ids it resumes with.
+
+All functions take a synchronous connection (use ``conn.run_sync``).
+"""
+import os
+import re
+import logging
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("MESSAGE_PARTITIONS", "0") == "1"
+MONTHS_AHEAD = int(os.getenv("MESSAGE_PARTITIONS_AHEAD", "3"))
+
+TABLE   = "messages"
+LEGACY  = "messages_legacy"
+DEFAULT = "messages_default"
+LOCK_ID = 0x6D736770  # advisory lock id for partition DDL
+
+_UPPER_RE = re.compile(r"TO \('([^']+)'\)")
+
+# the unique indexes of ``models.ChatMessage``, with the partition key added
+UNIQUE_INDEXES = {
+    "ux_messages_user_seq": "user_id, seq, timestamp",
+    "ux_messages_user_client_id": "user_id, client_id, timestamp",
+}
+
+
+def _month(at: datetime) -> datetime:
+    return datetime(at.year, at.month, 1)
+
+
+def _next_month(at: datetime) -> datetime:
+    return datetime(at.year + at.month // 12, at.month % 12 + 1, 1)
+
+
+def _partition_name(month: datetime) -> str:
+    return f"{TABLE}_p{month:%Y_%m}"
+
+
+def _lock(conn) -> None:
+    # held until commit; workers starting or archiving together take turns
+    conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": LOCK_ID})
+
+
+def is_partitioned(conn) -> bool:
+    kind = conn.execute(
+        text("SELECT relkind::text FROM pg_class WHERE oid = to_regclass(:table)"), {"table": TABLE}
+    ).scalar()
+    return kind == "p"
+
+
+def partitions(conn) -> List[Tuple[str, Optional[datetime]]]:
+    """(name, exclusive upper bound) of each partition; None for the default one."""
+    rows = conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(:table)"
+    ), {"table": TABLE}).all()
+    out = []
+    for name, bound in rows:
+        upper = _UPPER_RE.search(bound or "")
+        out.append((name, datetime.fromisoformat(upper.group(1)) if upper else None))
+    return out
+
+
+# ─── Conversion ────────────────────────────────────────────────────── #
+def partition_messages(conn) -> bool:
+    """Convert a plain ``messages`` table in place; True if it was converted."""
+    if conn.dialect.name != "postgresql" or not ENABLED:
+        return False
+    _lock(conn)
+    if is_partitioned(conn):
+        _create_unique_indexes(conn)  # ones added since the table was converted
+        ensure_partitions(conn)  # every start keeps the months ahead covered
+        return False
+
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": TABLE}).scalar()
+    conn.execute(text(f"LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE"))
+    conn.execute(text(f"ALTER TABLE {TABLE} RENAME TO {LEGACY}"))
+    # free the index names for the partitioned parent; matching indexes are attached, not rebuilt
+    conn.execute(text(f"ALTER INDEX IF EXISTS ix_messages_user_ts_id RENAME TO {LEGACY}_user_ts_id"))
+    for name in UNIQUE_INDEXES:
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    # a partition's primary key must match the parent's, which has to include the partition key
+    conn.execute(text(f"ALTER TABLE {LEGACY} DROP CONSTRAINT {TABLE}_pkey"))
+    conn.execute(text(f"ALTER TABLE {LEGACY} ADD CONSTRAINT {LEGACY}_pkey PRIMARY KEY (id, timestamp)"))
+
+    conn.execute(text(
+        f"CREATE TABLE {TABLE} (LIKE {LEGACY} INCLUDING DEFAULTS, PRIMARY KEY (id, timestamp)) "
+        f"PARTITION BY RANGE (timestamp)"
+    ))
+    conn.execute(text(f"ALTER TABLE {TABLE} ADD FOREIGN KEY (user_id) REFERENCES users (id)"))
+    if sequence:
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {TABLE}.id"))
+    conn.execute(text(f"CREATE INDEX ix_messages_user_ts_id ON {TABLE} (user_id, timestamp, id)"))
+    _create_unique_indexes(conn)
+
+    newest = conn.execute(text(f"SELECT max(timestamp) FROM {LEGACY}")).scalar()
+    if newest is None:
+        conn.execute(text(f"DROP TABLE {LEGACY}"))
+    else:
+        upper = _next_month(newest)
+        conn.execute(text(
+            f"ALTER TABLE {TABLE} ATTACH PARTITION {LEGACY} FOR VALUES FROM (MINVALUE) TO ('{upper:%Y-%m-%d}')"
+        ))
+    conn.execute(text(f"CREATE TABLE {DEFAULT} PARTITION OF {TABLE} DEFAULT"))
+    logger.info("%s is now partitioned by month%s", TABLE, "" if newest is None else f"; existing rows are {LEGACY}")
+    ensure_partitions(conn)
+    return True
+
+
+def _create_unique_indexes(conn) -> None:
+    for name, columns in UNIQUE_INDEXES.items():
+        conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {name} ON {TABLE} ({columns})"))
+
+
+# ─── Maintenance ───────────────────────────────────────────────────── #
+def ensure_partitions(conn, ahead: int = MONTHS_AHEAD, now: Optional[datetime] = None) -> List[str]:
+    """Create the partitions for this month and *ahead* more that don't exist yet."""
+    if conn.dialect.name != "postgresql" or not is_partitioned(conn):
+        return []
+    _lock(conn)
+    existing = partitions(conn)
+    covered = max((upper for _, upper in existing if upper is not None), default=None)
+    month = _month(now or datetime.utcnow())
+    if covered is not None and covered > month:
+        month = covered
+    last = _month(now or datetime.utcnow())
+    for _ in range(ahead):
+        last = _next_month(last)
+
+    created = []
+    while month <= last:
+        name, upper = _partition_name(month), _next_month(month)
+        try:
+            with conn.begin_nested():
+                conn.execute(text(
+                    f"CREATE TABLE {name} PARTITION OF {TABLE} "
+                    f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}')"
+                ))
+            created.append(name)
+        except Exception as exc:
+            # rows for this month already sit in the default partition; leave them there
+            logger.warning("could not create partition %s: %s", name, exc)
+        month = upper
+    if created:
+        logger.info("created partitions %s", ", ".join(created))
+    return created
+
+
+def drop_empty_partitions(conn, before: datetime) -> List[str]:
+    """Drop partitions that end on or before *before* and hold no rows any more."""
+    if conn.dialect.name != "postgresql" or not is_partitioned(conn):
+        return []
+    _lock(conn)
+    dropped = []
+    for name, upper in partitions(conn):
+        if upper is None or upper > before:
+            continue
+        if conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {name})")).scalar():
+            continue
+        conn.execute(text(f"DROP TABLE {name}"))
+        dropped.append(name)
+    if dropped:
+        logger.info("dropped empty partitions %s", ", ".join(dropped))
+    return dropped
@@ -0,0 +1,178 @@
+# backend/pipeline.py
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+async def _noop() -> None:
+    pass
+
+
+class SessionWriter:
+    """
+    Ordered, background DB work for one chat session.
+
+    Jobs are ``fn(*args, **kwargs)`` coroutines run one at a time in
+    submission order, so a turn's writes never overtake the previous turn's.
+    ``submit`` is fire-and-forget; ``call`` waits for the result (reads go
+    through the same queue so they observe every earlier write).
+
+    Jobs check out their own DB session (``db.session_scope``), so a pooled
+    connection is held only while a job runs, never while the user types.
+    """
+
+    def __init__(self, name: str = "") -> None:
+        self.name  = name
+        self._queue: "asyncio.Queue[Optional[tuple]]" = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    # ------------------------------------------------------------------ #
+    def submit(self, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> None:
+        self._queue.put_nowait((fn, args, kwargs, None))
+
+    def defer(self, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> asyncio.Future:
+        """Queue *fn* and return a future for its result without awaiting it."""
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((fn, args, kwargs, fut))
+        return fut
+
+    async def call(self, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        return await self.defer(fn, *args, **kwargs)
+
+    async def flush(self) -> None:
+        """Wait until every job queued so far has run (returns early if the writer stops)."""
+        if self._task.done():
+            return
+        fut = self.defer(_noop)
+        await asyncio.wait({fut, self._task}, return_when=asyncio.FIRST_COMPLETED)
+
+    async def close(self) -> None:
+        """Drain every queued job, then stop the worker."""
+        self._queue.put_nowait(None)
+        await self._task
+
+    # ------------------------------------------------------------------ #
+    async def _run(self) -> None:
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            fn, args, kwargs, fut = item
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as exc:
+                logger.exception("background write %s failed for %s", getattr(fn, "__name__", fn), self.name)
+                if fut is not None and not fut.done():
+                    fut.set_exception(exc)
+            else:
+                if fut is not None and not fut.done():
+                    fut.set_result(result)
+
+
+class TaskGroup:
+    """Fire-and-forget tasks tied to a connection; cancelled together on close."""
+
+    def __init__(self) -> None:
+        self._tasks: Set[asyncio.Task] = set()
+
+    def spawn(self, coro: Awaitable[Any]) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("background task failed: %s", task.exception())
+
+    async def cancel_all(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+class Superseded(Exception):
+    """Newer input arrived while a turn was still working on its reply."""
+
+
+class InboundQueue:
+    """
+    Bounded buffer between a connection's socket reader and its turn loop.
+
+    Text messages that arrive while a turn is busy are merged into the last
+    queued one (up to ``max_merge``), so a burst becomes a single turn.
+    Beyond ``max_depth`` queued turns, input is shed and the reader tells
+    the client.  ``race`` lets the turn loop drop work that newer input has
+    made pointless.
+    """
+
+    def __init__(self, max_depth: int = 4, max_merge: int = 5) -> None:
+        self.max_depth = max_depth
+        self.max_merge = max_merge
+        self.closed    = False
+        self._items: Deque[Tuple[str, Any]] = deque()   # ("text", [(text, ref)]) | (kind, payload)
+        self._ready = asyncio.Event()                    # set while items are queued or closed
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def put_text(self, text: str, ref: Any = None) -> str:
+        """
+        Queue a user message; returns ``"queued"``, ``"coalesced"`` or ``"shed"``.
+        Text items come out of ``get`` as the list of merged ``(text, ref)`` pairs.
+        """
+        if self._items:
+            kind, parts = self._items[-1]
+            if kind == "text" and len(parts) < self.max_merge:
+                parts.append((text, ref))
+                return "coalesced"
+        return "queued" if self.put("text", [(text, ref)]) else "shed"
+
+    def put(self, kind: str, payload: Any) -> bool:
+        if self.closed or len(self._items) >= self.max_depth:
+            return False
+        self._items.append((kind, payload))
+        self._ready.set()
+        return True
+
+    def close(self) -> None:
+        """No more input; ``get`` returns None once the queue is empty."""
+        self.closed = True
+        self._ready.set()
+
+    async def get(self) -> Optional[Tuple[str, Any]]:
+        while not self._items:
+            if self.closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        item = self._items.popleft()
+        if not self._items and not self.closed:
+            self._ready.clear()
+        return item
+
+    async def race(self, work: Awaitable[Any]) -> Any:
+        """Await *work* unless newer input (or the end of input) comes first; then cancel it and raise ``Superseded``."""
+        task    = asyncio.ensure_future(work)
+        arrival = asyncio.ensure_future(self._ready.wait())
+        try:
+            await asyncio.wait({task, arrival}, return_when=asyncio.FIRST_COMPLETED)
+        except BaseException:
+            task.cancel()
+            raise
+        finally:
+            arrival.cancel()
+        if task.done():
+            return task.result()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        raise Superseded()
+
+    def drain(self) -> List[Tuple[str, Any]]:
+        items = list(self._items)
+        self._items.clear()
+        return items
@@ -0,0 +1,312 @@
+# backend/reply_generator.py
+"""
+Pluggable reply wording.
+
+Every generator turns a state's base prompt (and, for clarifications, the
+validator's error) into the text sent to the user:
+
+- ``LLMReplyGenerator``      – rephrased by OpenAI (the original behaviour)
+- ``TemplateReplyGenerator`` – picked locally from per-state variant pools
+- ``HybridReplyGenerator``   – LLM, unless it misses a per-turn deadline,
+                               in which case the template reply is sent
+
+Select with ``REPLY_MODE=llm|template|hybrid`` and ``REPLY_DEADLINE_MS``.
+"""
+import os
+import random
+from abc import ABC, abstractmethod
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Dict, List, Optional, Set
+
+from backend.schemas import ConversationState
+from backend.metrics import REPLY_SOURCE
+
+logger = logging.getLogger(__name__)
+
+S = ConversationState
+
+# "{name}" variants are only used when the name is known; the base prompt is
+# always part of the pool
+TEMPLATE_VARIANTS: Dict[ConversationState, List[str]] = {
+    S.start: [
+        "Hi there! I'm here to get your insurance set up. First up, what's your zip code?",
+        "Welcome! Let's get your onboarding started. Could you tell me your zip code?",
+    ],
+    S.collecting_zip: [
+        "Could you share your 5-digit zip code?",
+        "Which 5-digit zip code should I use for you?",
+    ],
+    S.collecting_name: [
+        "Got it! And what's your full name?",
+        "Thanks! Could I have your first and last name?",
+    ],
+    S.collecting_email: [
+        "Nice to meet you, {name}! What's the best email address for you?",
+        "Thanks, {name}. Which email address should we use?",
+        "Great, what email address can we reach you at?",
+    ],
+    S.collecting_vehicle_info: [
+        "Now for your vehicle. Share the 17-character VIN, or the year, make and body type (like '2022 Honda Civic').",
+        "Let's add a vehicle, {name}. What's its VIN, or its year, make and body type (e.g. '2022 Honda Civic')?",
+    ],
+    S.collecting_vehicle_use: [
+        "What's this vehicle mainly used for: commuting, commercial, farming, or business?",
+        "How is this vehicle mostly used? Commuting, commercial, farming, or business?",
+    ],
+    S.collecting_blind_spot: [
+        "Does it have a blind spot warning system? Yes or No.",
+        "Is this vehicle equipped with blind spot warning? (Yes/No)",
+    ],
+    S.collecting_commute_days: [
+        "How many days a week do you drive it to work or school?",
+        "On how many days per week do you commute in this vehicle?",
+    ],
+    S.collecting_commute_miles: [
+        "About how many miles is your one-way commute?",
+        "How far is it, one way, to work or school (in miles)?",
+    ],
+    S.collecting_annual_mileage: [
+        "Roughly how many miles a year does this vehicle cover?",
+        "What's your best estimate of this vehicle's annual mileage?",
+    ],
+    S.ask_more_vehicles: [
+        "Got it! Is there another vehicle you'd like to add? (Yes or No)",
+        "All set with that vehicle, {name}. Do you want to add another one? (Yes/No)",
+    ],
+    S.collecting_license_type: [
+        "Almost done! What kind of license do you hold: Foreign, Personal, or Commercial?",
+        "Nearly there, {name}. Is your license Foreign, Personal, or Commercial?",
+    ],
+    S.collecting_license_status: [
+        "Last question: is your license Valid or Suspended?",
+        "And finally, what's the status of your license: Valid or Suspended?",
+    ],
+    S.completed: [
+        "That's everything, {name}. Your onboarding is complete. Thank you!",
+        "All done! Thanks for completing your onboarding.",
+    ],
+}
+
+CLARIFY_LEADS = ("Hmm, that didn't quite work.", "Sorry, I couldn't use that.", "Almost!", "Let's try that again.")
+
+
+class ReplyGenerator(ABC):
+    """
+    Interface: wording for a state's prompt and for validation errors.
+
+    ``pending`` is a reply for the same state that was started earlier
+    (see ``backend.speculation``); generators may use it instead of
+    starting their own work.
+    """
+
+    name = ""
+
+    @abstractmethod
+    async def reply(
+        self,
+        state: ConversationState,
+        base_prompt: str,
+        user_name: Optional[str] = None,
+        pending: Optional[Awaitable[str]] = None,
+    ) -> str:
+        ...
+
+    def speculate(
+        self, state: ConversationState, base_prompt: str, user_name: Optional[str] = None
+    ) -> Optional[Awaitable[str]]:
+        """Work worth starting before the user answers, or None when replies are instant anyway."""
+        return None
+
+    async def variant(self, state: ConversationState, base_prompt: str) -> str:
+        """A newly generated wording, never a cached one; ``PromptPool`` collects these."""
+        return await self.reply(state, base_prompt)
+
+    async def stream(
+        self, state: ConversationState, base_prompt: str, user_name: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """Yield the reply in pieces; generators without streaming yield it whole."""
+        yield await self.reply(state, base_prompt, user_name)
+
+    @abstractmethod
+    async def clarify(self, state: ConversationState, user_input: str, error: str) -> str:
+        ...
+
+
+class LLMReplyGenerator(ReplyGenerator):
+    name = "llm"
+
+    def __init__(self, client) -> None:
+        self.client = client
+
+    async def reply(self, state, base_prompt, user_name=None, pending=None) -> str:
+        if pending is not None:
+            try:
+                return await pending
+            except Exception as exc:
+                logger.info("speculative reply for %s failed: %s", state.value, exc)
+        return await self.client.generate_response(state.value, base_prompt, user_name=user_name)
+
+    def speculate(self, state, base_prompt, user_name=None):
+        return self.client.generate_response(state.value, base_prompt, user_name=user_name)
+
+    async def variant(self, state, base_prompt) -> str:
+        return await self.client.generate_response(state.value, base_prompt, fresh=True)
+
+    async def stream(self, state, base_prompt, user_name=None) -> AsyncIterator[str]:
+        async for delta in await self.client.generate_response(
+            state.value, base_prompt, user_name=user_name, stream=True
+        ):
+            yield delta
+
+    async def clarify(self, state, user_input, error) -> str:
+        return await self.client.generate_error_response(state.value, user_input, error)
+
+
+class TemplateReplyGenerator(ReplyGenerator):
+    name = "template"
+
+    def __init__(self, variants: Optional[Dict[ConversationState, List[str]]] = None, name_rate: float = 0.4) -> None:
+        self.variants  = TEMPLATE_VARIANTS if variants is None else variants
+        self.name_rate = name_rate  # use the name sparingly, as the LLM prompt asks
+
+    def render(self, state: ConversationState, base_prompt: str, user_name: Optional[str] = None) -> str:
+        pool = [base_prompt] + self.variants.get(state, [])
+        named = [v for v in pool if "{name}" in v]
+        if user_name and named and random.random() < self.name_rate:
+            return random.choice(named).format(name=user_name)
+        return random.choice([v for v in pool if "{name}" not in v] or [base_prompt])
+
+    async def reply(self, state, base_prompt, user_name=None, pending=None) -> str:
+        return self.render(state, base_prompt, user_name)
+
+    async def clarify(self, state, user_input, error) -> str:
+        return f"{random.choice(CLARIFY_LEADS)} {error}"
+
+
+class HybridReplyGenerator(ReplyGenerator):
+    """
+    Race the LLM against ``deadline`` seconds; on a miss send the template.
+
+    A streamed reply only has to *start* within the deadline.  A late LLM
+    reply is not thrown away: with the response cache on it still completes
+    (in the background) and serves the next user at that state.
+    """
+
+    name = "hybrid"
+
+    def __init__(self, llm: LLMReplyGenerator, template: TemplateReplyGenerator, deadline: float = 0.4) -> None:
+        self.llm      = llm
+        self.template = template
+        self.deadline = deadline
+        self._background: Set[asyncio.Task] = set()
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _race(self, coro, fallback):
+        try:
+            text = await asyncio.wait_for(coro, self.deadline)
+        except asyncio.TimeoutError:
+            REPLY_SOURCE.inc(source="template")
+            return await fallback()
+        REPLY_SOURCE.inc(source="llm")
+        return text
+
+    async def reply(self, state, base_prompt, user_name=None, pending=None) -> str:
+        return await self._race(
+            self.llm.reply(state, base_prompt, user_name, pending=pending),
+            lambda: self.template.reply(state, base_prompt, user_name),
+        )
+
+    def speculate(self, state, base_prompt, user_name=None):
+        # no deadline: the user's typing time is the head start
+        return self.llm.speculate(state, base_prompt, user_name)
+
+    async def variant(self, state, base_prompt) -> str:
+        # off the request path, so no deadline either
+        return await self.llm.variant(state, base_prompt)
+
+    async def stream(self, state, base_prompt, user_name=None) -> AsyncIterator[str]:
+        deltas = self.llm.stream(state, base_prompt, user_name)
+        first = asyncio.ensure_future(deltas.__anext__())
+        try:
+            done, _ = await asyncio.wait({first}, timeout=self.deadline)
+        except BaseException:
+            first.cancel()
+            raise
+        if not done:
+            # finish the stream off to the side so its text lands in the response cache
+            self._spawn(self._drain(first, deltas))
+            REPLY_SOURCE.inc(source="template")
+            yield await self.template.reply(state, base_prompt, user_name)
+            return
+        try:
+            delta = first.result()
+        except StopAsyncIteration:
+            return
+        REPLY_SOURCE.inc(source="llm")
+        yield delta
+        async for delta in deltas:
+            yield delta
+
+    @staticmethod
+    async def _drain(first: asyncio.Future, deltas: AsyncIterator[str]) -> None:
+        try:
+            await first
+            async for _ in deltas:
+                pass
+        except Exception:
+            pass  # the user already has the template reply
+
+    async def clarify(self, state, user_input, error) -> str:
+        return await self._race(
+            self.llm.clarify(state, user_input, error),
+            lambda: self.template.clarify(state, user_input, error),
+        )
+
+
+class PromptPool:
+    """
+    A handful of replies for one state, generated ahead of time so that
+    handing one out costs nothing (used for the greeting).
+    """
+
+    def __init__(self, generator: ReplyGenerator, state: ConversationState, base_prompt: str, size: int = 4) -> None:
+        self.generator   = generator
+        self.state       = state
+        self.base_prompt = base_prompt
+        self.size        = size
+        self.replies: List[str] = []
+
+    async def warm(self) -> None:
+        # one at a time: concurrent calls for the same prompt would share one
+        # upstream call (and one reply) through the response cache; each new
+        # wording is handed out as soon as it is ready
+        replies = self.replies = []
+        for _ in range(self.size):
+            try:
+                text = (await self.generator.variant(self.state, self.base_prompt)).strip()
+            except Exception as exc:
+                logger.info("prompt pool for %s: %s", self.state.value, exc)
+                continue
+            if text and text not in replies:
+                replies.append(text)
+        logger.info("prompt pool for %s: %d replies", self.state.value, len(self.replies))
+
+    def pick(self) -> Optional[str]:
+        return random.choice(self.replies) if self.replies else None
+
+
+def build_generator(client, mode: Optional[str] = None) -> ReplyGenerator:
+    mode = (mode or os.getenv("REPLY_MODE", "llm")).lower()
+    if mode == "template":
+        return TemplateReplyGenerator()
+    if mode == "hybrid":
+        deadline = float(os.getenv("REPLY_DEADLINE_MS", "400")) / 1000
+        return HybridReplyGenerator(LLMReplyGenerator(client), TemplateReplyGenerator(), deadline=deadline)
+    if mode != "llm":
+        logger.warning("unknown REPLY_MODE %r, using llm", mode)
+    return LLMReplyGenerator(client)
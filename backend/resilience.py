@@ -0,0 +1,234 @@
+# backend/resilience.py
+"""
+Admission control for upstream (OpenAI) calls.
+
+``UpstreamGuard`` puts every call behind, in order:
+
+1. a circuit breaker: while open, calls fail immediately with
+   ``CircuitOpenError`` so callers can fall back without waiting;
+2. a concurrency semaphore plus an optional token bucket sized to the
+   provider's rate limit; waiting for either counts against the deadline;
+3. a per-call deadline, inside which transient failures are retried with
+   jittered exponential backoff (honouring ``Retry-After`` on 429s).
+
+Failures that only say "the provider is unhealthy" (timeouts, connection
+errors, 429, 5xx) trip the breaker; request errors such as a 400 do not.
+"""
+import time
+import random
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+import openai
+
+from backend.metrics import LLM_BREAKER_STATE, LLM_QUEUE_DEPTH, LLM_REJECTED, LLM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE = (
+    asyncio.TimeoutError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+class UpstreamUnavailable(Exception):
+    """The call was not attempted (breaker open) or could not finish before its deadline."""
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class DeadlineExceeded(UpstreamUnavailable, asyncio.TimeoutError):
+    pass
+
+
+def _remaining(deadline: float) -> float:
+    return deadline - time.monotonic()
+
+
+# ------------------------------------------------------------------ #
+#  Rate limiting
+# ------------------------------------------------------------------ #
+class TokenBucket:
+    """``rate`` tokens per second, up to ``burst``; waiters are served FIFO."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self.rate     = rate
+        self.capacity = burst or max(rate, 1.0)
+        self._tokens  = self.capacity
+        self._stamp   = time.monotonic()
+        self._lock    = asyncio.Lock()
+
+    async def acquire(self, deadline: float) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+                self._stamp  = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+                if wait > _remaining(deadline):
+                    raise DeadlineExceeded("rate limit wait exceeds deadline")
+                await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    """Classic closed → open → half-open breaker; half-open lets one probe through."""
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+    _GAUGE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, failure_threshold: int = 5, reset_after: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_after       = reset_after
+        self.failures  = 0
+        self._state    = self.CLOSED
+        self._opened   = 0.0
+        self._probing  = False
+        LLM_BREAKER_STATE.set(0)
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened >= self.reset_after:
+            self._set(self.HALF_OPEN)
+        return self._state
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._probing = False
+        if self._state != self.CLOSED:
+            logger.info("upstream circuit closed")
+            self._set(self.CLOSED)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self._state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self._state != self.OPEN:
+                logger.warning("upstream circuit open after %d failures", self.failures)
+            self._opened = time.monotonic()
+            self._set(self.OPEN)
+
+    def cancel_probe(self) -> None:
+        self._probing = False
+
+    def _set(self, state: str) -> None:
+        self._state = state
+        LLM_BREAKER_STATE.set(self._GAUGE[state])
+
+
+# ------------------------------------------------------------------ #
+#  Guard
+# ------------------------------------------------------------------ #
+class UpstreamGuard:
+    def __init__(
+        self,
+        max_concurrency: int = 32,
+        rate: float = 0.0,
+        burst: Optional[float] = None,
+        timeout: float = 10.0,
+        retries: int = 2,
+        backoff: float = 0.25,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self._sem    = asyncio.Semaphore(max_concurrency)
+        self._bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.waiting = 0
+
+    def deadline(self, timeout: Optional[float] = None) -> float:
+        return time.monotonic() + (self.timeout if timeout is None else timeout)
+
+    @asynccontextmanager
+    async def slot(self, deadline: float) -> AsyncIterator[None]:
+        """Hold one unit of upstream concurrency (and one rate token) until the block exits."""
+        if not self.breaker.allow():
+            LLM_REJECTED.inc(reason="circuit_open")
+            raise CircuitOpenError("upstream circuit is open")
+        self.waiting += 1
+        LLM_QUEUE_DEPTH.set(self.waiting)
+        try:
+            try:
+                await asyncio.wait_for(self._sem.acquire(), max(_remaining(deadline), 0))
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded("no upstream slot before deadline") from None
+            try:
+                if self._bucket is not None:
+                    await self._bucket.acquire(deadline)
+            except BaseException:
+                self._sem.release()
+                raise
+        except DeadlineExceeded:
+            LLM_REJECTED.inc(reason="queue_timeout")
+            self.breaker.cancel_probe()  # a queued probe never reached upstream
+            raise
+        finally:
+            self.waiting -= 1
+            LLM_QUEUE_DEPTH.set(self.waiting)
+        try:
+            yield
+        finally:
+            self._sem.release()
+
+    async def call(self, fn: Callable[[], Awaitable[T]], deadline: float) -> T:
+        """
+        Await ``fn()`` with retries inside *deadline*; the caller holds a ``slot``.
+
+        Breaker bookkeeping happens here, so a stream that fails after this
+        returns should report through ``breaker.record_failure`` itself.
+        """
+        attempt = 0
+        while True:
+            try:
+                result = await asyncio.wait_for(fn(), max(_remaining(deadline), 0))
+            except RETRYABLE as exc:
+                self.breaker.record_failure()
+                delay = self._retry_delay(exc, attempt)
+                if attempt >= self.retries or delay >= _remaining(deadline) or not self.breaker.allow():
+                    if isinstance(exc, asyncio.TimeoutError):
+                        raise DeadlineExceeded("upstream call exceeded deadline") from exc
+                    raise
+                attempt += 1
+                LLM_RETRIES.inc()
+                logger.info("retrying upstream call in %.2fs after %s", delay, type(exc).__name__)
+                await asyncio.sleep(delay)
+            except BaseException:
+                # not a health signal (bad request, cancellation): don't strand a half-open probe
+                self.breaker.cancel_probe()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+
+    def _retry_delay(self, exc: BaseException, attempt: int) -> float:
+        # full jitter; a 429's Retry-After is a floor
+        delay = random.uniform(0, self.backoff * (2 ** attempt))
+        response = getattr(exc, "response", None)
+        if isinstance(exc, openai.RateLimitError) and response is not None:
+            try:
+                delay = max(delay, float(response.headers.get("retry-after", 0)))
+            except (TypeError, ValueError):
+                pass
+        return delay
@@ -46,4 +46,16 @@ class UserResponse(BaseModel):
     license_type: Optional[str]
     license_status: Optional[str]
     vehicles: List[Dict[str, Any]]
-    created_at: datetime
\ No newline at end of file
+    created_at: datetime
+
+class MessageOut(BaseModel):
+    id: int
+    role: MessageRole
+    content: str
+    timestamp: datetime
+    seq: Optional[int] = None
+
+class MessagePage(BaseModel):
+    messages: List[MessageOut]          # oldest first
+    next_cursor: Optional[str] = None   # pass as ?cursor= for older messages
+    latest_cursor: Optional[str] = None # pass as ?since= for newer messages
@@ -0,0 +1,139 @@
+# backend/session_cache.py
+from typing import Any, Dict, List, Optional
+
+from backend.flow import FLOW
+from backend.schemas import ConversationState
+from backend.models import User, Session as SessionModel
+import backend.crud as crud
+
+USER_FIELDS = ("zip_code", "full_name", "email", "license_type", "license_status")
+_MISSING = object()
+
+
+def _copy(value: Any) -> Any:
+    """Copy of nested dicts/lists, enough to diff against later (cheaper than ``deepcopy``)."""
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
+
+
+def state_patches(old: Dict[str, Any], new: Dict[str, Any], path: tuple = ()) -> List[tuple]:
+    """
+    ``crud.UnitOfWork.patch_state_data`` patches that turn *old* into *new*:
+    only changed keys, recursing into dicts that are non-empty on both sides.
+    """
+    patches = []
+    for key in old.keys() - new.keys():
+        patches.append(("del", path + (key,), None))
+    for key, value in new.items():
+        before = old.get(key, _MISSING)
+        if before == value and type(before) is type(value):
+            continue
+        if isinstance(value, dict) and value and isinstance(before, dict) and before:
+            patches.extend(state_patches(before, value, path + (key,)))
+        else:
+            patches.append(("set", path + (key,), value))
+    return patches
+
+
+class SessionSnapshot:
+    """
+    In-memory copy of one chat session: the user's profile fields, the
+    conversation state and the decoded ``state_data``.
+
+    The owning WebSocket is the only writer, so reads never hit Postgres.
+    Writes are applied here first and tracked as dirty until ``drain_into``
+    hands them to a ``crud.UnitOfWork``.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        user_id: int,
+        user_fields: Dict[str, Any],
+        current_state: str,
+        state_data: Dict[str, Any],
+        last_reply: Optional[str] = None,
+        last_seq: int = 0,
+    ) -> None:
+        self.session_id    = session_id
+        self.user_id       = user_id
+        self.user_fields   = user_fields
+        self.current_state = FLOW.resume_state(ConversationState(current_state))
+        self.state_data    = state_data
+        self._saved_state_data = _copy(state_data)  # as Postgres has it; drained as a diff
+        self.last_reply    = last_reply  # the open question as worded; re-sent on reconnect
+        self.last_seq      = last_seq    # highest message seq handed out
+        self.stale         = False       # a write failed: memory is ahead of Postgres, reload
+
+        self._dirty_user: Dict[str, Any] = {}
+        self._dirty_state = False
+
+    @classmethod
+    def from_rows(
+        cls,
+        user: User,
+        session: SessionModel,
+        last_reply: Optional[str] = None,
+        last_seq: Optional[int] = None,
+    ) -> "SessionSnapshot":
+        return cls(
+            session_id=user.session_id,
+            user_id=user.id,
+            user_fields={f: getattr(user, f) for f in USER_FIELDS},
+            current_state=session.current_state,
+            state_data=_copy(session.state_data or {}),
+            last_reply=last_reply,
+            last_seq=last_seq or 0,
+        )
+
+    # ------------------------------------------------------------------ #
+    @property
+    def full_name(self) -> Optional[str]:
+        return self.user_fields.get("full_name")
+
+    @property
+    def is_new(self) -> bool:
+        """Nothing has been said yet: the session still needs its greeting."""
+        return self.current_state == ConversationState.start
+
+    def next_seq(self) -> int:
+        """The ``seq`` for the session's next message."""
+        self.last_seq += 1
+        return self.last_seq
+
+    def update_user(self, **fields) -> None:
+        for key, value in fields.items():
+            if key in USER_FIELDS:
+                self.user_fields[key] = value
+                self._dirty_user[key] = value
+
+    def set_state(self, state: ConversationState) -> None:
+        """Move to *state*; ``state_data`` is written along with it."""
+        self.current_state = state
+        self._dirty_state  = True
+
+    def drain_into(self, uow: "crud.UnitOfWork") -> None:
+        """Record pending writes on *uow* and mark the snapshot clean."""
+        if self._dirty_user:
+            uow.update_user(**self._dirty_user)
+            self._dirty_user = {}
+        if self._dirty_state:
+            uow.update_session_state(self.current_state.value)
+            uow.patch_state_data(state_patches(self._saved_state_data, self.state_data))
+            self._saved_state_data = _copy(self.state_data)
+            self._dirty_state = False
+
+
+async def load_snapshot(db, session_id: str) -> SessionSnapshot:
+    """(Re)read the session from Postgres; one query for a known session."""
+    row = await crud.load_session(db, session_id)
+    if row is not None and row.Session is not None:
+        return SessionSnapshot.from_rows(
+            row.User, row.Session, row.last_reply,
+            max(row.last_seq or 0, row.archived_seq or 0),
+        )
+    user = await crud.get_or_create_user(db, session_id)
+    return SessionSnapshot.from_rows(user, await crud.get_session(db, user.id))
@@ -0,0 +1,60 @@
+# backend/speculation.py
+"""
+Speculative reply generation for one chat connection.
+
+As soon as a prompt is sent, the states the conversation can move to next
+are known (one, or two at a branch).  Their replies are started in the
+background while the user types; the valid answer then ``take``s the one
+that matches and the rest are cancelled.  Replies are keyed on the state
+and the user's name, so one prepared before the user gave their name is
+not sent once it is known.  A per-session budget caps how many replies
+may be generated this way.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from backend.schemas import ConversationState
+from backend.metrics import SPECULATION
+
+logger = logging.getLogger(__name__)
+
+
+class Speculator:
+    def __init__(
+        self,
+        start: Callable[[ConversationState, Optional[str]], Optional[Awaitable[str]]],
+        budget: int = 30,
+    ) -> None:
+        self._start    = start
+        self.remaining = budget
+        self._tasks: Dict[Tuple[ConversationState, Optional[str]], asyncio.Task] = {}
+
+    def start(self, states: Iterable[ConversationState], user_name: Optional[str] = None) -> None:
+        """Begin generating replies for *states* (already running ones are kept)."""
+        for state in states:
+            if (state, user_name) in self._tasks:
+                continue
+            if self.remaining <= 0:
+                SPECULATION.inc(result="over_budget")
+                return
+            work = self._start(state, user_name)
+            if work is None:
+                continue
+            self.remaining -= 1
+            task = asyncio.ensure_future(work)
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._tasks[(state, user_name)] = task
+
+    def take(self, state: ConversationState, user_name: Optional[str] = None) -> Optional[asyncio.Task]:
+        """The (possibly still running) reply for *state* addressed to *user_name*; every other guess is discarded."""
+        task = self._tasks.pop((state, user_name), None)
+        SPECULATION.inc(result="hit" if task is not None else "miss")
+        self.discard()
+        return task
+
+    def discard(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+            SPECULATION.inc(result="wasted")
+        self._tasks.clear()
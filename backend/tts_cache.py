@@ -0,0 +1,96 @@
+# backend/tts_cache.py
+import os
+import asyncio
+import hashlib
+import logging
+import tempfile
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AudioCache:
+    """
+    Content-addressed on-disk store for synthesized speech.
+
+    Files are named by ``sha256(model, voice, text)`` and evicted least
+    recently used once the directory exceeds ``max_bytes``.  The index is
+    rebuilt from file mtimes at start-up, and hits bump the mtime, so recency
+    survives restarts.
+    """
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.total     = 0
+        self._index: "OrderedDict[str, int]" = OrderedDict()  # key -> size, oldest first
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    @staticmethod
+    def key(text: str, voice: str, model: str) -> str:
+        return hashlib.sha256(f"{model}\x00{voice}\x00{text}".encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.mp3")
+
+    def _scan(self) -> None:
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".mp3"):
+                    st = os.stat(os.path.join(root, name))
+                    entries.append((st.st_mtime, name[:-4], st.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self.total += size
+        self._evict()
+
+    # ------------------------------------------------------------------ #
+    async def get(self, key: str) -> Optional[bytes]:
+        if key not in self._index:
+            return None
+        self._index.move_to_end(key)
+        try:
+            return await asyncio.to_thread(self._read, self._path(key))
+        except OSError:
+            self.total -= self._index.pop(key, 0)
+            return None
+
+    async def put(self, key: str, data: bytes) -> None:
+        if not data or key in self._index:
+            return
+        try:
+            await asyncio.to_thread(self._write, self._path(key), data)
+        except OSError as e:
+            logger.warning("TTS cache write failed: %s", e)
+            return
+        self._index[key] = len(data)
+        self.total += len(data)
+        self._evict()
+
+    def _evict(self) -> None:
+        while self.total > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self.total -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    # ------------------------------------------------------------------ #
+    @staticmethod
+    def _read(path: str) -> bytes:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)  # recency for the next start-up scan
+        return data
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)  # atomic: readers never see a partial file
@@ -0,0 +1,125 @@
+# bench/fake_openai.py
+"""
+Local stand-in for the OpenAI endpoints the backend calls.
+
+Latency, streaming cadence and error rate are configurable so load tests are
+repeatable and free:
+
+    python -m bench.fake_openai --port 8765 --latency-ms 800 --chunk-ms 30 --error-rate 0.02
+"""
+import json
+import time
+import random
+import asyncio
+import argparse
+from dataclasses import dataclass
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+
+
+@dataclass
+class FakeConfig:
+    latency_ms: float   = 300.0  # time to first token / full response
+    jitter_ms: float    = 100.0  # ± uniform jitter on latency
+    chunk_ms: float     = 20.0   # gap between streamed chunks
+    chunk_words: int    = 2      # words per streamed chunk
+    error_rate: float   = 0.0    # fraction of calls answered with HTTP 500
+    tts_ms: float       = 400.0
+    stt_ms: float       = 300.0
+
+
+def _reply_for(messages) -> str:
+    """Echo the base message the backend asked to rephrase, so replies stay on-script."""
+    prompt = messages[-1]["content"] if messages else ""
+    for line in prompt.splitlines():
+        if line.startswith("Base message:"):
+            return "Sure! " + line.split(":", 1)[1].strip()
+        if line.startswith("Error:"):
+            return "Oops — " + line.split(":", 1)[1].strip()
+    return "Okay."
+
+
+def create_app(cfg: FakeConfig) -> FastAPI:
+    app = FastAPI(title="fake-openai")
+    app.state.calls = 0
+
+    async def _delay(ms: float) -> None:
+        await asyncio.sleep(max(0.0, ms + random.uniform(-cfg.jitter_ms, cfg.jitter_ms)) / 1000)
+
+    def _failed() -> bool:
+        return random.random() < cfg.error_rate
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request):
+        app.state.calls += 1
+        body = await request.json()
+        if _failed():
+            return JSONResponse({"error": {"message": "injected failure", "type": "server_error"}}, status_code=500)
+        text  = _reply_for(body.get("messages", []))
+        model = body.get("model", "fake")
+        ident = f"chatcmpl-{app.state.calls}"
+        await _delay(cfg.latency_ms)
+
+        if not body.get("stream"):
+            return {
+                "id": ident, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": text}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }
+
+        async def _events():
+            words = text.split(" ")
+            for i in range(0, len(words), cfg.chunk_words):
+                piece = " ".join(words[i:i + cfg.chunk_words]) + (" " if i + cfg.chunk_words < len(words) else "")
+                chunk = {
+                    "id": ident, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(cfg.chunk_ms / 1000)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(_events(), media_type="text/event-stream")
+
+    @app.post("/v1/audio/speech")
+    async def speech(request: Request):
+        body = await request.json()
+        await _delay(cfg.tts_ms)
+        return Response(b"ID3" + body.get("input", "").encode()[:64], media_type="audio/mpeg")
+
+    @app.post("/v1/audio/transcriptions")
+    async def transcriptions():
+        await _delay(cfg.stt_ms)
+        return PlainTextResponse("12345")
+
+    @app.get("/stats")
+    async def stats():
+        return {"calls": app.state.calls}
+
+    return app
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake OpenAI server for load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=FakeConfig.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=FakeConfig.jitter_ms)
+    parser.add_argument("--chunk-ms", type=float, default=FakeConfig.chunk_ms)
+    parser.add_argument("--chunk-words", type=int, default=FakeConfig.chunk_words)
+    parser.add_argument("--error-rate", type=float, default=FakeConfig.error_rate)
+    args = parser.parse_args()
+
+    cfg = FakeConfig(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, chunk_ms=args.chunk_ms,
+        chunk_words=args.chunk_words, error_rate=args.error_rate,
+    )
+    uvicorn.run(create_app(cfg), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
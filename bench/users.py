@@ -0,0 +1,139 @@
+# bench/users.py
+"""
+Simulated chat users: each one opens ``/ws`` and walks a scripted path
+through the onboarding flow, timing every turn.
+
+Run on its own (``python -m bench.users --url ws://127.0.0.1:8000/ws``) or
+via ``bench.run``, which starts the app and reads the JSON this prints.
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from typing import Dict, List, Tuple
+
+import websockets
+
+# (text, valid?) — invalid lines exercise the error-clarification path
+SCRIPTS: Dict[str, List[Tuple[str, bool]]] = {
+    "single_commute": [
+        ("12345", True), ("Jane Doe", True), ("jane@example.com", True),
+        ("2022 Honda Civic", True), ("commuting", True), ("yes", True),
+        ("5", True), ("12", True), ("no", True), ("personal", True), ("valid", True),
+    ],
+    "multi_vehicle": [
+        ("94103", True), ("John Smith", True), ("john@example.com", True),
+        ("2021 Toyota Camry", True), ("commuting", True), ("no", True), ("3", True), ("20", True),
+        ("yes", True),
+        ("2019 Ford F150", True), ("business", True), ("yes", True), ("15,000", True),
+        ("no", True), ("commercial", True), ("suspended", True),
+    ],
+    "typos_foreign": [
+        ("1234", False), ("60601", True), ("Ann", False), ("Ann Lee", True),
+        ("ann-at-lee", False), ("ann@lee.io", True),
+        ("1HGCM82633A004352", True), ("racing", False), ("farming", True), ("maybe", False), ("no", True),
+        ("8000", True), ("no", True), ("foreign", True),
+    ],
+}
+
+GREETING = {"bot_message", "bot_message_done"}
+
+
+async def _recv_until(ws, done: set, first: set) -> Tuple[float, float]:
+    """Read frames until one of *done*; returns (time of first *first* frame, end time)."""
+    t_first = None
+    while True:
+        raw = await ws.recv()
+        if isinstance(raw, bytes):
+            continue  # audio
+        kind = json.loads(raw).get("type")
+        if t_first is None and kind in first:
+            t_first = time.perf_counter()
+        if kind in done:
+            end = time.perf_counter()
+            return (t_first or end), end
+
+
+async def simulate_user(
+    url: str,
+    name: str,
+    script: str,
+    think: float,
+    connected: asyncio.Event,
+    go: asyncio.Event,
+    ready: List[int],
+) -> Dict:
+    turns: List[Dict] = []
+    errors = 0
+    try:
+        async with websockets.connect(f"{url}&session={name}", max_size=None) as ws:
+            await _recv_until(ws, GREETING, GREETING)
+            ready[0] += 1
+            connected.set()
+            await go.wait()
+            for text, valid in SCRIPTS[script]:
+                await asyncio.sleep(random.uniform(0, think))
+                # valid turns end with state_update; clarifications are a single bot_message
+                done = {"state_update"} if valid else {"bot_message"}
+                started = time.perf_counter()
+                await ws.send(json.dumps({"type": "user_message", "content": text}))
+                t_first, end = await asyncio.wait_for(
+                    _recv_until(ws, done, {"bot_message", "bot_message_delta"}), timeout=60
+                )
+                turns.append({"script": script, "valid": valid,
+                              "latency": end - started, "ttft": t_first - started})
+    except Exception as exc:
+        errors += 1
+        print(f"[{name}] {type(exc).__name__}: {exc}", file=sys.stderr)
+    return {"turns": turns, "errors": errors}
+
+
+async def run_users(url: str, users: int, think: float, ramp: float, seed: int) -> Dict:
+    random.seed(seed)
+    connected, go = asyncio.Event(), asyncio.Event()
+    ready = [0]
+    names = list(SCRIPTS)
+    run_id = f"{int(time.time())}-{random.randrange(1 << 20)}"
+    tasks = []
+    for i in range(users):
+        tasks.append(asyncio.create_task(simulate_user(
+            url, f"bench-{run_id}-{i}", names[i % len(names)], think, connected, go, ready,
+        )))
+        if ramp:
+            await asyncio.sleep(ramp / users)
+
+    # wait until every user is connected and greeted, then release them together
+    while ready[0] + sum(t.done() for t in tasks) < users:
+        await asyncio.sleep(0.05)
+    print(json.dumps({"event": "connected", "users": ready[0]}), flush=True)
+    await asyncio.sleep(1.0)  # idle window for memory sampling
+    started = time.perf_counter()
+    go.set()
+    results = await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "event": "done",
+        "users": users,
+        "elapsed": elapsed,
+        "errors": sum(r["errors"] for r in results),
+        "turns": [t for r in results for t in r["turns"]],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Drive scripted WebSocket users.")
+    parser.add_argument("--url", default="ws://127.0.0.1:8000/ws?stream=1")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--think", type=float, default=0.0, help="max think time between turns (s)")
+    parser.add_argument("--ramp", type=float, default=0.0, help="spread connects over this many seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    url = args.url if "?" in args.url else args.url + "?"
+    print(json.dumps(asyncio.run(run_users(url, args.users, args.think, args.ramp, args.seed))), flush=True)
+
+
+if __name__ == "__main__":
+    main()
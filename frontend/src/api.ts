@@ -17,6 +17,10 @@ class WebSocketClient {
   private reconnectInterval = 5_000;
   private shouldReconnect = true;
   private sessionId: string;
+  /* highest message seq received; a reconnect asks only for what came after it */
+  private lastSeq: number | null = null;
+  /* user messages not yet acknowledged, resent after a reconnect */
+  private pending = new Map<string, any>();
 
   constructor(
     private onMessage: (data: any) => void,
@@ -40,29 +44,61 @@ class WebSocketClient {
   connect() {
     const wsScheme = API_BASE_URL.startsWith('https') ? 'wss' : 'ws';
     const wsHost   = API_BASE_URL.replace(/^https?:\/\//, '');
-    const url      = `${wsScheme}://${wsHost}/ws?session=${this.sessionId}`;
+    const since    = this.lastSeq === null ? '' : `&last_seq=${this.lastSeq}`;
+    const url      = `${wsScheme}://${wsHost}/ws?session=${this.sessionId}&stream=1${since}`;
 
     this.ws = new WebSocket(url);
+    this.ws.binaryType = 'arraybuffer';
 
-    this.ws.onopen    = () => { console.log('[WS] open');  this.onConnect(); };
-    this.ws.onclose   = () => { console.log('[WS] close'); this.onDisconnect();
-                                if (this.shouldReconnect) setTimeout(()=>this.connect(),this.reconnectInterval); };
+    this.ws.onopen    = () => { console.log('[WS] open');  this.onConnect();
+                                 /* the server acks each id once; resends it already has are only re-acked */
+                                 this.pending.forEach(p => this.send(p)); };
+    this.ws.onclose   = (e) => { console.log('[WS] close'); this.onDisconnect();
+                                 /* 4409: the chat was opened in another tab; don't fight it for the session */
+                                 if (e.code === 4409) this.shouldReconnect = false;
+                                 if (this.shouldReconnect) setTimeout(()=>this.connect(),this.reconnectInterval); };
     this.ws.onerror   = (e) =>  console.error('[WS] error:', e);
     this.ws.onmessage = (e) => {
-      try   { this.onMessage(JSON.parse(e.data)); }
-      catch { console.error('[WS] bad JSON', e.data); }
+      /* binary frames carry synthesized speech (mp3) */
+      if (e.data instanceof ArrayBuffer) { this.onMessage({ type: 'bot_audio', bytes: e.data }); return; }
+      let msg: any;
+      try   { msg = JSON.parse(e.data); }
+      catch { console.error('[WS] bad JSON', e.data); return; }
+      this.track(msg);
+      this.onMessage(msg);
     };
   }
 
+  /** seq bookkeeping; stream deltas don't count until their message is done */
+  private track(msg: any) {
+    const seq = msg.data?.seq;
+    if (typeof seq === 'number' && msg.type !== 'bot_message_delta') this.lastSeq = Math.max(this.lastSeq ?? 0, seq);
+    /* a resume says where the server's numbering stands; numbers it never saved are reused */
+    if (msg.data?.resumed && typeof msg.data.last_seq === 'number') this.lastSeq = msg.data.last_seq;
+    if ((msg.type === 'ack' || msg.type === 'message_dropped') && msg.data?.id) this.pending.delete(msg.data.id);
+  }
+
+  /** user text message with an idempotency id (returned) */
+  sendMessage(content: string) {
+    const id = `msg_${Date.now()}_${Math.random().toString(36).slice(2, 8)}`;
+    const payload = { type: 'user_message', content, id };
+    this.pending.set(id, payload);
+    this.send(payload);
+    return id;
+  }
+
   /** generic JSON payload */
   send(payload: any) {
     if (this.ws?.readyState === WebSocket.OPEN) this.ws.send(JSON.stringify(payload));
   }
 
-  /** helper for audio -> base64 (future voice feature) */
-  sendAudio(buf: ArrayBuffer) {
-    const b64 = btoa(String.fromCharCode(...new Uint8Array(buf)));
-    this.send({ type: 'user_audio', content: b64 });
+  /** voice upload: start frame, raw binary chunks, end frame */
+  sendAudio(buf: ArrayBuffer, format = 'webm') {
+    if (this.ws?.readyState !== WebSocket.OPEN) return;
+    const CHUNK = 64 * 1024;
+    this.send({ type: 'user_audio_start', data: { format } });
+    for (let off = 0; off < buf.byteLength; off += CHUNK) this.ws.send(buf.slice(off, off + CHUNK));
+    this.send({ type: 'user_audio_end' });
   }
 
   disconnect() { this.shouldReconnect = false; this.ws?.close(); }
@@ -41,6 +41,7 @@ const ChatWindow: React.FC = () => {
   const inputRef          = useRef<HTMLInputElement>(null);
   const mediaRecorderRef  = useRef<MediaRecorder | null>(null);
   const recordedChunksRef = useRef<BlobPart[]>([]);
+  const streamingIdRef    = useRef<string | null>(null);
 
   /* ------------------------------------------------------------------ */
   /*  WebSocket lifecycle                                               */
@@ -52,19 +53,69 @@ const ChatWindow: React.FC = () => {
         /* ------- assistant text ------- */
         if (data.type === 'bot_message') {
           setIsTyping(false);
-          setMessages((prev) => [
-            ...prev,
-            { id:`msg_${Date.now()}`,role:'assistant',content:data.content,timestamp:new Date() },
-          ]);
+          setMessages((prev) => {
+            /* a reconnect repeats the open question; don't show it twice */
+            const last = prev[prev.length - 1];
+            if (data.data?.resumed && last?.role === 'assistant' && last.content === data.content) return prev;
+            return [
+              ...prev,
+              { id:`msg_${Date.now()}`,role:'assistant',content:data.content,timestamp:new Date() },
+            ];
+          });
+          if (data.data?.state) {
+            setConversationState((prev)=>({...prev,currentState:data.data.state}));
+          }
+        }
+
+        /* ------- streamed assistant text ------- */
+        if (data.type === 'bot_message_delta') {
+          setIsTyping(false);
+          if (!streamingIdRef.current) {
+            const id = `msg_${Date.now()}`;
+            streamingIdRef.current = id;
+            setMessages((prev) => [
+              ...prev,
+              { id, role:'assistant', content:data.content, timestamp:new Date() },
+            ]);
+          } else {
+            const id = streamingIdRef.current;
+            setMessages((prev) => prev.map(m => m.id === id ? { ...m, content: m.content + data.content } : m));
+          }
+        }
+
+        if (data.type === 'bot_message_done') {
+          const id = streamingIdRef.current;
+          streamingIdRef.current = null;
+          setIsTyping(false);
+          setMessages((prev) => id
+            ? prev.map(m => m.id === id ? { ...m, content: data.content } : m)
+            : [...prev, { id:`msg_${Date.now()}`, role:'assistant', content:data.content, timestamp:new Date() }]);
           if (data.data?.state) {
             setConversationState((prev)=>({...prev,currentState:data.data.state}));
           }
         }
 
+        /* ------- delta sync after a reconnect: messages this tab missed ------- */
+        if (data.type === 'message_replay') {
+          setMessages((prev) => {
+            const id = data.data?.id ?? `seq_${data.data?.seq}`;
+            if (prev.some(m => m.id === id)) return prev;  /* our own message, shown when sent */
+            return [...prev, { id, role:data.data?.role, content:data.content, timestamp:new Date() }];
+          });
+        }
+
+        /* ------- notices: input shed (sending too fast), chat opened elsewhere ------- */
+        if (data.type === 'message_dropped' || data.type === 'session_taken_over') {
+          setMessages((prev) => [
+            ...prev,
+            { id:`msg_${Date.now()}`, role:'assistant', content:data.content, timestamp:new Date() },
+          ]);
+        }
+
         /* ------- assistant audio ------- */
         if (data.type === 'bot_audio') {
           try {
-            const bytes = Uint8Array.from(atob(data.content), c => c.charCodeAt(0));
+            const bytes = data.bytes ?? Uint8Array.from(atob(data.content), c => c.charCodeAt(0));
             const blob  = new Blob([bytes], { type: 'audio/mpeg' });
             const url   = URL.createObjectURL(blob);
             const audio = new Audio(url);
@@ -96,12 +147,12 @@ const ChatWindow: React.FC = () => {
   const sendMessage = () => {
     if (!input.trim() || !isConnected) return;
 
+    const id = wsClient.current?.sendMessage(input) ?? `msg_${Date.now()}`;
     setMessages(prev => [
       ...prev,
-      { id:`msg_${Date.now()}`, role:'user', content:input, timestamp:new Date() },
+      { id, role:'user', content:input, timestamp:new Date() },
     ]);
     setIsTyping(true);
-    wsClient.current?.send({ type:'user_message', content:input });
     setInput('');
     inputRef.current?.focus();
   };